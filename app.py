@@ -1,8 +1,17 @@
 from dotenv import load_dotenv
 load_dotenv('.env')
 
+import logging
+import time
+from datetime import timedelta
+
+import click
+
 from spotitag import app, db
-from spotitag.models import Artist, Tag, User, Album
+from spotitag.models import Artist, Tag, User, Album, Job
+from spotitag.refresh import refresh_stale_metadata
+from spotitag.search import rebuild_index
+from spotitag import bulk, jobs
 
 @app.shell_context_processor
 def make_shell_context():
@@ -12,4 +21,87 @@ def make_shell_context():
         'Tag': Tag,
         'Artist': Artist,
         'Album': Album,
+        'Job': Job,
     }
+
+
+@app.cli.command('refresh-metadata')
+@click.option('--loop', is_flag=True, help='Keep refreshing at a fixed interval.')
+def refresh_metadata(loop):
+    """Refresh stale Spotify metadata stored on artists and albums."""
+    while True:
+        max_age = timedelta(hours=app.config['METADATA_MAX_AGE_HOURS'])
+        refreshed = refresh_stale_metadata(max_age)
+        click.echo(f'Refreshed metadata for {refreshed} items')
+
+        if not loop:
+            break
+        time.sleep(app.config['METADATA_REFRESH_INTERVAL'])
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Rebuild the local search index over artist and album names."""
+    for model in (Artist, Album):
+        rebuild_index(model.__table__)
+    db.session.commit()
+
+
+@app.cli.command('worker')
+@click.option('--once', is_flag=True, help='Exit once the queue is empty.')
+def worker(once):
+    """Run queued import jobs."""
+    logging.basicConfig(level=logging.INFO)
+    jobs.work(once=once)
+
+
+def _user(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f'No user named {username!r}', param_hint='USERNAME')
+    return user
+
+
+@app.cli.command('import-tags')
+@click.argument('username')
+@click.argument('input_file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS),
+              help='Defaults to csv for .csv files and jsonl otherwise.')
+@click.option('--replace', is_flag=True,
+              help="Replace the user's tags on every imported item.")
+@click.option('--batch-size', type=int, help='Records per transaction.')
+def import_tags(username, input_file, fmt, replace, batch_size):
+    """Import (kind, spotify_id, tags) records as JSON Lines or CSV."""
+    user = _user(username)
+    fmt = fmt or bulk.format_for(input_file.name)
+
+    try:
+        stats = bulk.import_records(
+            user,
+            bulk.read_records(input_file, fmt),
+            batch_size=batch_size or app.config['BULK_BATCH_SIZE'],
+            replace=replace,
+        )
+    except bulk.BulkFormatError as error:
+        raise click.ClickException(str(error))
+
+    click.echo(
+        f'Imported {stats.records} records ({stats.associations} tags) '
+        f'in {stats.seconds:.1f}s, {stats.as_dict()["records_per_second"]} records/s',
+        err=True,
+    )
+
+
+@app.cli.command('export-tags')
+@click.argument('username')
+@click.argument('output_file', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS),
+              help='Defaults to csv for .csv files and jsonl otherwise.')
+def export_tags(username, output_file, fmt):
+    """Export a user's tags as JSON Lines or CSV."""
+    user = _user(username)
+    fmt = fmt or bulk.format_for(output_file.name)
+
+    records = bulk.export_records(user, batch_size=app.config['BULK_BATCH_SIZE'])
+    for chunk in bulk.write_records(records, fmt):
+        output_file.write(chunk)
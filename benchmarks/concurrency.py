@@ -0,0 +1,206 @@
+"""Throughput of sync and gevent gunicorn workers against the Spotify stand-in.
+
+Seeds a throwaway SQLite database, starts benchmarks.fake_spotify in its
+own process and, for every worker class, runs gunicorn with the
+repository's gunicorn.conf.py on a fresh copy of the database. Then it
+keeps ``--concurrency`` requests for search results and tag pages in
+flight and reports throughput and latency per mode. Run it with
+``python -m benchmarks.concurrency``.
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.run import configure_environment, seed_database
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='sync,gevent',
+                        help='Comma separated gunicorn worker classes')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='Requests kept in flight')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Requests per mode')
+    parser.add_argument('--pages', default='result,tags',
+                        help='Comma separated pages to request: result, tags')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--tags', type=int, default=2000)
+    parser.add_argument('--associations', type=int, default=10000)
+    parser.add_argument('--artists', type=int, default=2000)
+    parser.add_argument('--albums-per-artist', type=int, default=4)
+    parser.add_argument('--cold-fraction', type=float, default=0.5,
+                        help='Fraction of items seeded without stored metadata')
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    # Runs a server module in a subprocess, so that its threads do not
+    # compete with the load generator for the GIL.
+
+    def __init__(self, module, *args, env=None):
+        self.port = _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.__module = module
+        self.__process = subprocess.Popen(
+            [sys.executable, '-m', module,
+             *(arg.format(port=self.port) for arg in args)],
+            cwd=ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+
+    def __enter__(self):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                requests.get(self.url, timeout=5)
+                return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.__process.kill()
+        raise RuntimeError(f'{self.__module} did not start')
+
+    def __exit__(self, *exc_info):
+        self.__process.terminate()
+        self.__process.wait(timeout=30)
+
+
+def login(url):
+    session = requests.Session()
+    token = _CSRF_TOKEN.search(session.get(f'{url}/login').text).group(1)
+    response = session.post(f'{url}/login', data={
+        'csrf_token': token, 'username': 'user0', 'password': 'benchmark'})
+    response.raise_for_status()
+    return session.cookies.get_dict()
+
+
+def load(url, paths, cookies, concurrency):
+    local = threading.local()
+
+    def fetch(path):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+            session.cookies.update(cookies)
+
+        start = time.perf_counter()
+        try:
+            response = session.get(f'{url}{path}', timeout=60)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(fetch, paths))
+    elapsed = time.perf_counter() - start
+
+    latency = sorted(seconds for _, seconds in outcomes)
+    return {
+        'requests': len(outcomes),
+        'errors': sum(not ok for ok, _ in outcomes),
+        'requests_per_second': len(outcomes) / elapsed,
+        'p50_ms': 1000 * statistics.median(latency),
+        'p99_ms': 1000 * latency[min(len(latency) - 1, int(len(latency) * 0.99))],
+    }
+
+
+def report(summary):
+    print(f'{"mode":<10}{"n":>6}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for mode, row in summary.items():
+        print(f'{mode:<10}{row["requests"]:>6}{row["errors"]:>8}'
+              f'{row["requests_per_second"]:>10.1f}{row["p50_ms"]:>10.1f}'
+              f'{row["p99_ms"]:>10.1f}')
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    from benchmarks.fake_spotify import build_corpus
+
+    corpus = build_corpus(args.artists, args.albums_per_artist, args.seed)
+    fake_spotify = Server(
+        'benchmarks.fake_spotify', '--port={port}',
+        f'--artists={args.artists}',
+        f'--albums-per-artist={args.albums_per_artist}',
+        f'--seed={args.seed}',
+        f'--latency={args.latency}',
+        f'--jitter={args.jitter}',
+    )
+
+    summary = {}
+    with fake_spotify, tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, fake_spotify.url)
+
+        from spotitag import app
+
+        with app.app_context():
+            seed_database(args, corpus, rng)
+
+        # Search results for numbers match the artists named after them,
+        # so every query is a search cache miss with a few results.
+        pages = {
+            'result': lambda: f'/result/{rng.randint(400, args.artists)}',
+            'tags': lambda: f'/tags?after={rng.randint(0, args.tags)}',
+        }
+        choices = [pages[page] for page in args.pages.split(',')]
+        paths = [rng.choice(choices)() for _ in range(args.requests)]
+
+        for mode in args.modes.split(','):
+            database = os.path.join(workdir, f'{mode}.sqlite3')
+            shutil.copy(os.path.join(workdir, 'spotitag.sqlite3'), database)
+
+            env = dict(
+                os.environ,
+                DATABASE_URL=f'sqlite:///{database}',
+                SPOTITAG_WORKER_CLASS=mode,
+                # Nothing should be served from an earlier mode's caches.
+                SPOTITAG_CACHE_BACKEND='memory',
+                # The stand-in does not rate limit, and the client-side
+                # limits would otherwise cap both modes alike.
+                SPOTIFY_RATE_LIMIT='100000',
+                SPOTIFY_RATE_BURST=str(args.concurrency),
+                SPOTIFY_POOL_SIZE=str(args.concurrency),
+                SPOTIFY_FANOUT_WORKERS=str(args.concurrency),
+            )
+            gunicorn = Server(
+                'gunicorn', 'app:app', '--bind=127.0.0.1:{port}',
+                f'--workers={args.workers}', env=env)
+            with gunicorn:
+                cookies = login(gunicorn.url)
+                summary[mode] = load(gunicorn.url, paths, cookies, args.concurrency)
+
+    report(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Offline stand-in for the parts of the Spotify Web API spotitag uses.
+
+Serves artists, albums, artist albums, playlists, search and
+client-credentials tokens from a deterministic fixture corpus, with optional latency and
+injected 429 responses. Point the app at it with
+
+    SPOTIFY_API_URL=http://127.0.0.1:8900/v1/
+    SPOTIFY_TOKEN_URL=http://127.0.0.1:8900/api/token
+
+and run it with ``python -m benchmarks.fake_spotify``.
+"""
+import argparse
+import json
+import random
+import string
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, jsonify, request, url_for
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+
+ADJECTIVES = [
+    'Velvet', 'Electric', 'Silent', 'Golden', 'Broken', 'Crystal', 'Midnight',
+    'Wild', 'Lonely', 'Neon', 'Frozen', 'Burning', 'Hidden', 'Little',
+    'Northern', 'Paper', 'Restless', 'Scarlet', 'Hollow', 'Lazy',
+]
+NOUNS = [
+    'Owls', 'Rivers', 'Machines', 'Hearts', 'Wolves', 'Echoes', 'Giants',
+    'Lanterns', 'Sparrows', 'Tides', 'Ghosts', 'Engines', 'Mirrors', 'Saints',
+    'Pilots', 'Orchards', 'Comets', 'Shadows', 'Strangers', 'Tigers',
+]
+ALBUM_WORDS = [
+    'Live', 'Sessions', 'Vol. 2', 'Reprise', 'Anthology', 'Demos', 'Remastered',
+    'Nights', 'Days', 'Stories', 'Songs', 'Letters', 'Rooms', 'Years',
+]
+ALBUM_GROUPS = ['album', 'album', 'album', 'single', 'compilation', 'appears_on']
+
+
+def build_corpus(artists=5000, albums_per_artist=4, seed=0, playlists=50,
+                 tracks_per_playlist=150):
+    rng = random.Random(seed)
+
+    def spotify_id():
+        return ''.join(rng.choice(string.ascii_letters + string.digits)
+                       for _ in range(22))
+
+    def images(kind, item_id):
+        if rng.random() < 0.05:
+            return []
+        return [
+            {'url': f'https://i.fake.scdn.co/{kind}/{item_id}/{size}',
+             'width': size, 'height': size}
+            for size in (640, 300, 64)
+        ]
+
+    corpus = {'artists': {}, 'albums': {}, 'artist_albums': {}, 'playlists': {}}
+    for number in range(artists):
+        artist_id = spotify_id()
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}'
+        if number >= len(ADJECTIVES) * len(NOUNS):
+            name = f'{name} {number}'
+
+        artist = {
+            'id': artist_id,
+            'type': 'artist',
+            'name': name,
+            'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+            'images': images('artist', artist_id),
+            'genres': [],
+            'popularity': rng.randint(0, 100),
+        }
+        corpus['artists'][artist_id] = artist
+        corpus['artist_albums'][artist_id] = []
+
+        for _ in range(rng.randint(1, albums_per_artist * 2 - 1)):
+            album_id = spotify_id()
+            group = rng.choice(ALBUM_GROUPS)
+            album = {
+                'id': album_id,
+                'type': 'album',
+                'name': f'{rng.choice(NOUNS)} {rng.choice(ALBUM_WORDS)}',
+                'album_type': 'compilation' if group == 'appears_on' else group,
+                'album_group': group,
+                'external_urls': {'spotify': f'https://open.spotify.com/album/{album_id}'},
+                'images': images('album', album_id),
+                'artists': [{'id': artist_id, 'name': name, 'type': 'artist'}],
+                'release_date': str(rng.randint(1960, 2021)),
+            }
+            corpus['albums'][album_id] = album
+            corpus['artist_albums'][artist_id].append(album_id)
+
+    album_ids = list(corpus['albums'])
+    for _ in range(playlists if album_ids else 0):
+        tracks = []
+        for _ in range(rng.randint(1, tracks_per_playlist * 2 - 1)):
+            album = corpus['albums'][rng.choice(album_ids)]
+            tracks.append({
+                'id': spotify_id(),
+                'type': 'track',
+                'name': f'{rng.choice(ADJECTIVES)} {rng.choice(ALBUM_WORDS)}',
+                'artists': album['artists'],
+                'album': {key: album[key] for key in
+                          ('id', 'type', 'name', 'album_type', 'external_urls',
+                           'images', 'artists', 'release_date')},
+            })
+        corpus['playlists'][spotify_id()] = tracks
+
+    return corpus
+
+
+def create_app(corpus, latency=0.0, jitter=0.0, rate_limit_probability=0.0,
+               retry_after=1, seed=0):
+    app = Flask(__name__)
+    app.calls = Counter()
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    @app.before_request
+    def simulate_network():
+        app.calls[request.endpoint] += 1
+        with rng_lock:
+            delay = latency + rng.uniform(0, jitter)
+            limited = rng.random() < rate_limit_probability
+
+        if delay:
+            time.sleep(delay)
+
+        if limited and request.endpoint != 'token':
+            app.calls['rate_limited'] += 1
+            response = _error(429, 'API rate limit exceeded')
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+
+    @app.route('/api/token', methods=['POST'])
+    def token():
+        return jsonify(
+            access_token='fake-token', token_type='Bearer', expires_in=3600)
+
+    @app.route('/v1/artists/')
+    @app.route('/v1/artists')
+    def artists():
+        ids = _ids(50)
+        if ids is None:
+            return _error(400, 'Too many ids requested')
+        return jsonify(artists=[corpus['artists'].get(i) for i in ids])
+
+    @app.route('/v1/artists/<artist_id>')
+    def artist(artist_id):
+        if artist_id not in corpus['artists']:
+            return _error(404, 'non existing id')
+        return jsonify(corpus['artists'][artist_id])
+
+    @app.route('/v1/albums/')
+    @app.route('/v1/albums')
+    def albums():
+        ids = _ids(20)
+        if ids is None:
+            return _error(400, 'Too many ids requested')
+        return jsonify(albums=[corpus['albums'].get(i) for i in ids])
+
+    @app.route('/v1/albums/<album_id>')
+    def album(album_id):
+        if album_id not in corpus['albums']:
+            return _error(404, 'non existing id')
+        return jsonify(corpus['albums'][album_id])
+
+    @app.route('/v1/artists/<artist_id>/albums')
+    def artist_albums(artist_id):
+        if artist_id not in corpus['artists']:
+            return _error(404, 'non existing id')
+
+        # spotipy still sends the older album_type name.
+        groups = request.args.get('include_groups') or request.args.get('album_type')
+        items = [corpus['albums'][i] for i in corpus['artist_albums'][artist_id]]
+        if groups:
+            groups = set(groups.split(','))
+            items = [item for item in items if item['album_group'] in groups]
+
+        return jsonify(_page(items, 'artist_albums', artist_id=artist_id))
+
+    @app.route('/v1/playlists/<playlist_id>/tracks')
+    def playlist_tracks(playlist_id):
+        if playlist_id not in corpus['playlists']:
+            return _error(404, 'Not found.')
+
+        # The fields filter is ignored, callers get whole track objects.
+        items = [
+            {'added_at': '2021-03-01T00:00:00Z', 'is_local': False, 'track': track}
+            for track in corpus['playlists'][playlist_id]
+        ]
+        return jsonify(_page(
+            items, 'playlist_tracks', maximum=100, playlist_id=playlist_id))
+
+    @app.route('/v1/search')
+    def search():
+        query = request.args.get('q', '')
+        if query.startswith('artist:'):
+            query = query[len('artist:'):]
+        query = query.casefold()
+
+        items = [
+            artist for artist in corpus['artists'].values()
+            if query in artist['name'].casefold()
+        ]
+        return jsonify(artists=_page(items, 'search'))
+
+    return app
+
+
+def _ids(maximum):
+    ids = [i for i in request.args.get('ids', '').split(',') if i]
+    if len(ids) > maximum:
+        return None
+    return ids
+
+
+def _page(items, endpoint, maximum=50, **values):
+    limit = min(request.args.get('limit', 20, type=int), maximum)
+    offset = request.args.get('offset', 0, type=int)
+
+    next_url = None
+    if offset + limit < len(items):
+        args = dict(request.args, offset=offset + limit, limit=limit)
+        next_url = url_for(endpoint, _external=True, **values, **args)
+
+    return {
+        'href': request.url,
+        'items': items[offset:offset + limit],
+        'limit': limit,
+        'offset': offset,
+        'total': len(items),
+        'next': next_url,
+        'previous': None,
+    }
+
+
+def _error(status, message):
+    response = jsonify(error={'status': status, 'message': message})
+    response.status_code = status
+    return response
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class FakeSpotifyServer:
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        self.app = app
+        self.__server = make_server(
+            host, port, app, threaded=True,
+            request_handler=_QuietRequestHandler)
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://{self.__server.host}:{self.__server.port}'
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--corpus', help='JSON corpus written by --dump-corpus')
+    parser.add_argument('--dump-corpus', help='Write the generated corpus and exit')
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--albums-per-artist', type=int, default=4)
+    parser.add_argument('--playlists', type=int, default=50)
+    parser.add_argument('--tracks-per-playlist', type=int, default=150)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Maximum random seconds added on top of --latency')
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0,
+                        help='Fraction of API requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as corpus_file:
+            corpus = json.load(corpus_file)
+    else:
+        corpus = build_corpus(
+            args.artists, args.albums_per_artist, args.seed,
+            args.playlists, args.tracks_per_playlist)
+
+    if args.dump_corpus:
+        with open(args.dump_corpus, 'w') as corpus_file:
+            json.dump(corpus, corpus_file)
+        return
+
+    app = create_app(
+        corpus,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_probability=args.rate_limit_probability,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
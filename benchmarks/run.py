@@ -0,0 +1,283 @@
+"""End-to-end benchmark of spotitag against the offline Spotify stand-in.
+
+Seeds a throwaway SQLite database, starts benchmarks.fake_spotify in a
+background thread and drives the main pages through the Flask test
+client. Reports p50/p99 latency, SQL queries and Spotify calls per
+endpoint. Run it with ``python -m benchmarks.run``. ``--json`` writes the
+results and ``--baseline`` fails when a previous result regressed.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--tags', type=int, default=10000)
+    parser.add_argument('--associations', type=int, default=50000)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--albums-per-artist', type=int, default=4)
+    parser.add_argument('--cold-fraction', type=float, default=0.1,
+                        help='Fraction of items seeded without stored metadata')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='Requests per endpoint')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Compare against a previous --json file')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Allowed slowdown factor against the baseline')
+    return parser.parse_args()
+
+
+def configure_environment(workdir, spotify_url):
+    os.environ.update({
+        'SPOTITAG_SECRET_KEY': 'benchmark',
+        'SPOTITAG_METRICS_LOG': '0',
+        'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "spotitag.sqlite3")}',
+        'SPOTITAG_CACHE_PATH': os.path.join(workdir, 'cache.sqlite3'),
+        'SPOTIFY_API_URL': f'{spotify_url}/v1/',
+        'SPOTIFY_TOKEN_URL': f'{spotify_url}/api/token',
+        'SPOTIPY_CLIENT_ID': 'benchmark',
+        'SPOTIPY_CLIENT_SECRET': 'benchmark',
+    })
+
+
+def seed_database(args, corpus, rng):
+    from datetime import datetime
+    from werkzeug.security import generate_password_hash
+
+    from spotitag import db
+    from spotitag.models import User, Tag, Artist, Album, artist_tags, album_tags
+    from spotitag.search import rebuild_index
+
+    db.create_all()
+    password_hash = generate_password_hash('benchmark')
+
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{n}', 'email': f'user{n}@example.com',
+         'password_hash': password_hash}
+        for n in range(args.users)
+    ])
+
+    for model, items in ((Artist, corpus['artists']), (Album, corpus['albums'])):
+        rows = []
+        for item in items.values():
+            cold = rng.random() < args.cold_fraction
+            images = sorted(item['images'], key=lambda image: image['width'])
+            rows.append({
+                'spotify_id': item['id'],
+                'spotify_name': None if cold else item['name'],
+                'spotify_url': None if cold else item['external_urls']['spotify'],
+                'image_url': None if cold or not images else images[0]['url'],
+                'fetched_at': None if cold else datetime.utcnow(),
+            })
+        db.session.execute(model.__table__.insert(), rows)
+
+    db.session.execute(Tag.__table__.insert(), [
+        {'label': f'tag {n}', 'normalized_label': f'tag {n}', 'user_id': n % args.users + 1}
+        for n in range(args.tags)
+    ])
+
+    artist_count = len(corpus['artists'])
+    album_count = len(corpus['albums'])
+    associations = {'artist': set(), 'album': set()}
+    while sum(map(len, associations.values())) < args.associations:
+        tag_id = rng.randint(1, args.tags)
+        if rng.random() < 0.5:
+            associations['artist'].add((tag_id, rng.randint(1, artist_count)))
+        else:
+            associations['album'].add((tag_id, rng.randint(1, album_count)))
+
+    db.session.execute(artist_tags.insert(), [
+        {'tag_id': tag_id, 'artist_id': artist_id}
+        for tag_id, artist_id in associations['artist']
+    ])
+    db.session.execute(album_tags.insert(), [
+        {'tag_id': tag_id, 'album_id': album_id}
+        for tag_id, album_id in associations['album']
+    ])
+
+    # Fill in the summaries that tag edits normally keep up to date.
+    Tag.refresh_item_counts(range(1, args.tags + 1))
+    rebuild_index(Artist.__table__)
+    rebuild_index(Album.__table__)
+    for user in User.query:
+        for kind in ('artist', 'album'):
+            user.refresh_item_tags(kind, {
+                item_id for tag_id, item_id in associations[kind]
+                if (tag_id - 1) % args.users + 1 == user.id
+            })
+    db.session.commit()
+
+    # Items the benchmark user has tagged, used for the edit pages.
+    user_tags = {tag_id for tag_id in range(1, args.tags + 1)
+                 if (tag_id - 1) % args.users == 0}
+    artist_ids = list(corpus['artists'])
+    album_ids = list(corpus['albums'])
+    tagged_artists = [artist_ids[a - 1] for t, a in associations['artist'] if t in user_tags]
+    tagged_albums = [album_ids[a - 1] for t, a in associations['album'] if t in user_tags]
+    return tagged_artists, tagged_albums
+
+
+class Counters:
+
+    def __init__(self, engine, fake_app):
+        from sqlalchemy import event
+
+        self.queries = 0
+        self.__fake_app = fake_app
+        event.listen(engine, 'before_cursor_execute', self.__count_query)
+
+    def __count_query(self, *args):
+        self.queries += 1
+
+    def spotify_calls(self):
+        calls = self.__fake_app.calls
+        return sum(count for endpoint, count in calls.items()
+                   if endpoint not in ('token', 'rate_limited'))
+
+
+def drive(client, counters, name, paths, results):
+    for method, path, data in paths:
+        queries = counters.queries
+        spotify_calls = counters.spotify_calls()
+
+        start = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {path} returned {response.status_code}')
+
+        results[name]['latency'].append(elapsed)
+        results[name]['queries'].append(counters.queries - queries)
+        results[name]['spotify_calls'].append(counters.spotify_calls() - spotify_calls)
+
+
+def summarize(results):
+    summary = {}
+    for name, samples in results.items():
+        latency = sorted(samples['latency'])
+        summary[name] = {
+            'requests': len(latency),
+            'p50_ms': 1000 * statistics.median(latency),
+            'p99_ms': 1000 * latency[min(len(latency) - 1, int(len(latency) * 0.99))],
+            'queries': statistics.mean(samples['queries']),
+            'spotify_calls': statistics.mean(samples['spotify_calls']),
+        }
+    return summary
+
+
+def report(summary):
+    print(f'{"endpoint":<24}{"n":>6}{"p50 ms":>10}{"p99 ms":>10}'
+          f'{"queries":>10}{"spotify":>10}')
+    for name, row in summary.items():
+        print(f'{name:<24}{row["requests"]:>6}{row["p50_ms"]:>10.1f}'
+              f'{row["p99_ms"]:>10.1f}{row["queries"]:>10.1f}'
+              f'{row["spotify_calls"]:>10.1f}')
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for name, row in summary.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if row['p99_ms'] > before['p99_ms'] * tolerance:
+            found.append(f'{name}: p99 {before["p99_ms"]:.1f} -> {row["p99_ms"]:.1f} ms')
+        for counter in ('queries', 'spotify_calls'):
+            if row[counter] > before[counter] + 0.5:
+                found.append(f'{name}: {counter} {before[counter]:.1f} -> {row[counter]:.1f}')
+    return found
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    from benchmarks.fake_spotify import build_corpus, create_app, FakeSpotifyServer
+
+    corpus = build_corpus(args.artists, args.albums_per_artist, args.seed)
+    fake_app = create_app(
+        corpus,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_probability=args.rate_limit_probability,
+        seed=args.seed,
+    )
+    server = FakeSpotifyServer(fake_app).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, server.url)
+
+        from spotitag import app, db
+
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        with app.app_context():
+            tagged_artists, tagged_albums = seed_database(args, corpus, rng)
+            counters = Counters(db.engine, fake_app)
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'user0', 'password': 'benchmark'})
+
+        names = [artist['name'] for artist in corpus['artists'].values()]
+        searches = [rng.choice(names).split()[rng.randint(0, 1)] for _ in range(args.requests)]
+        artists = [rng.choice(tagged_artists) for _ in range(args.requests)]
+        albums = [rng.choice(tagged_albums) for _ in range(args.requests)]
+        pages = [0] + [rng.randint(1, args.tags) for _ in range(args.requests - 1)]
+        # Prefixes of the benchmark user's labels, as typed.
+        labels = [f'tag {n}' for n in range(0, args.tags, args.users)]
+        prefixes = [label[:rng.randint(1, len(label))]
+                    for label in (rng.choice(labels) for _ in range(args.requests))]
+
+        results = defaultdict(lambda: defaultdict(list))
+        drive(client, counters, '/result/<artist>',
+              [('GET', f'/result/{query}', None) for query in searches], results)
+        drive(client, counters, '/tags',
+              [('GET', f'/tags?after={after}', None) for after in pages], results)
+        drive(client, counters, '/api/tags/complete',
+              [('GET', f'/api/tags/complete?q={prefix}', None) for prefix in prefixes],
+              results)
+        drive(client, counters, 'GET /editartist/<id>',
+              [('GET', f'/editartist/{spotify_id}', None) for spotify_id in artists], results)
+        drive(client, counters, 'POST /editartist/<id>',
+              [('POST', f'/editartist/{spotify_id}', {'new_tags': 'tag 1;benchmark'})
+               for spotify_id in artists], results)
+        drive(client, counters, 'GET /editalbum/<id>',
+              [('GET', f'/editalbum/{spotify_id}', None) for spotify_id in albums], results)
+        drive(client, counters, 'POST /editalbum/<id>',
+              [('POST', f'/editalbum/{spotify_id}', {'new_tags': 'tag 1;benchmark'})
+               for spotify_id in albums], results)
+
+    server.stop()
+
+    summary = summarize(results)
+    report(summary)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(summary, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            found = regressions(summary, json.load(baseline_file), args.tolerance)
+        for regression in found:
+            print(f'REGRESSION {regression}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
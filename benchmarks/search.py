@@ -0,0 +1,99 @@
+"""Latency of the local artist name search.
+
+Stores the artists of a generated corpus through Artist.store_details in
+batches, which indexes their names as it goes, then rebuilds the index
+from scratch and times Artist.search_local for queries as users type
+them. Fails when the p99 lookup exceeds ``--target-ms``. The corpus
+names are built from 40 words, so a word matches about 5% of the index,
+which makes this a worst case. Run it with ``python -m benchmarks.search``.
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--artists', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--results', type=int, default=20)
+    parser.add_argument('--target-ms', type=float, default=10.0,
+                        help='Maximum p99 lookup latency')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    from benchmarks.fake_spotify import build_corpus
+    from benchmarks.run import configure_environment
+
+    corpus = build_corpus(args.artists, albums_per_artist=1, seed=args.seed, playlists=0)
+    details = [
+        {'id': artist['id'], 'name': artist['name'],
+         'url': artist['external_urls']['spotify'], 'image': None}
+        for artist in corpus['artists'].values()
+    ]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Spotify is never called.
+        configure_environment(workdir, 'http://127.0.0.1:9')
+
+        from spotitag import app, db
+        from spotitag.models import Artist
+        from spotitag.search import rebuild_index
+
+        with app.app_context():
+            db.create_all()
+
+            start = time.perf_counter()
+            for offset in range(0, len(details), args.batch_size):
+                Artist.store_details(details[offset:offset + args.batch_size])
+                db.session.commit()
+            store_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rebuild_index(Artist.__table__)
+            db.session.commit()
+            rebuild_seconds = time.perf_counter() - start
+
+            # One or two words of a name, the last one possibly unfinished.
+            queries = []
+            for _ in range(args.queries):
+                words = rng.choice(details)['name'].split()
+                words = words[:rng.randint(1, min(2, len(words)))]
+                words[-1] = words[-1][:rng.randint(1, len(words[-1]))]
+                queries.append(' '.join(words))
+
+            latency = []
+            found = 0
+            for query in queries:
+                start = time.perf_counter()
+                artists = Artist.search_local(query, args.results)
+                latency.append(time.perf_counter() - start)
+                found += bool(artists)
+                db.session.expunge_all()
+
+    latency.sort()
+    p50 = 1000 * statistics.median(latency)
+    p99 = 1000 * latency[min(len(latency) - 1, int(len(latency) * 0.99))]
+
+    print(f'stored and indexed {len(details)} artists in {store_seconds:.1f}s '
+          f'({len(details) / store_seconds:.0f}/s)')
+    print(f'rebuilt the index in {rebuild_seconds:.2f}s')
+    print(f'{len(queries)} lookups: p50 {p50:.2f} ms, p99 {p99:.2f} ms, '
+          f'{found} with results')
+
+    if p99 > args.target_ms:
+        print(f'p99 above the {args.target_ms} ms target')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+import os
+
+# "sync" serves one request per worker process at a time. "gevent" runs
+# each request on a greenlet, so a worker waiting on Spotify keeps
+# serving other requests in the meantime.
+worker_class = os.environ.get('SPOTITAG_WORKER_CLASS', 'sync')
+worker_connections = int(os.environ.get('SPOTITAG_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    postgres = os.environ.get('DATABASE_URL', '').startswith('postgres')
+    if 'gevent' in worker_class and postgres:
+        # psycopg2 blocks the whole worker on a query unless it waits
+        # through gevent instead.
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
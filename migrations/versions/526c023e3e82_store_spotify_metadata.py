@@ -0,0 +1,119 @@
+"""Store Spotify metadata on artists and albums
+
+Revision ID: 526c023e3e82
+Revises: 3c63c807cb99
+Create Date: 2026-10-18 09:12:40.118263
+
+"""
+import logging
+import os
+from datetime import datetime
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '526c023e3e82'
+down_revision = '3c63c807cb99'
+branch_labels = None
+depends_on = None
+
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+# (table, spotipy method and response key, maximum IDs per request)
+BACKFILL = (
+    ('artist', 'artists', 50),
+    ('album', 'albums', 20),
+)
+
+
+def upgrade():
+    for table in ('album', 'artist'):
+        op.add_column(table, sa.Column('spotify_name', sa.String(length=256), nullable=True))
+        op.add_column(table, sa.Column('spotify_url', sa.String(length=256), nullable=True))
+        op.add_column(table, sa.Column('image_url', sa.String(length=256), nullable=True))
+        op.add_column(table, sa.Column('fetched_at', sa.DateTime(), nullable=True))
+        op.create_index(op.f(f'ix_{table}_fetched_at'), table, ['fetched_at'], unique=False)
+
+    _backfill()
+
+
+def downgrade():
+    for table in ('artist', 'album'):
+        op.drop_index(op.f(f'ix_{table}_fetched_at'), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('fetched_at')
+            batch_op.drop_column('image_url')
+            batch_op.drop_column('spotify_url')
+            batch_op.drop_column('spotify_name')
+
+
+def _backfill():
+    # Rows that are not backfilled here are loaded on first render and
+    # kept fresh by `flask refresh-metadata`.
+    if context.is_offline_mode():
+        return
+    if not (os.environ.get('SPOTIPY_CLIENT_ID') and os.environ.get('SPOTIPY_CLIENT_SECRET')):
+        logger.info('No Spotify credentials, skipping metadata backfill.')
+        return
+
+    import spotipy
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    client = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
+    connection = op.get_bind()
+
+    for table_name, endpoint, batch_size in BACKFILL:
+        table = sa.table(
+            table_name,
+            sa.column('id'),
+            sa.column('spotify_id'),
+            sa.column('spotify_name'),
+            sa.column('spotify_url'),
+            sa.column('image_url'),
+            sa.column('fetched_at'),
+        )
+        update = table.update().where(table.c.id == sa.bindparam('item_id'))
+
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                sa.select(table.c.id, table.c.spotify_id)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+
+            try:
+                results = getattr(client, endpoint)([row.spotify_id for row in rows])
+            except spotipy.SpotifyException as error:
+                logger.warning('Stopping %s backfill: %s', table_name, error)
+                break
+
+            fetched_at = datetime.utcnow()
+            values = [
+                {
+                    'item_id': row.id,
+                    'spotify_name': result['name'],
+                    'spotify_url': result['external_urls']['spotify'],
+                    'image_url': _smallest_image(result['images']),
+                    'fetched_at': fetched_at,
+                }
+                for row, result in zip(rows, results[endpoint])
+                if result is not None
+            ]
+            if values:
+                connection.execute(update, values)
+
+            last_id = rows[-1].id
+
+
+def _smallest_image(images):
+    if len(images) == 0:
+        return None
+
+    return min(images, key=lambda r: r['width'])['url']
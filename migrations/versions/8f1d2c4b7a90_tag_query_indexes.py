@@ -0,0 +1,29 @@
+"""Indexes for tag queries
+
+Revision ID: 8f1d2c4b7a90
+Revises: 526c023e3e82
+Create Date: 2026-10-18 16:52:07.402611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f1d2c4b7a90'
+down_revision = '526c023e3e82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The unique constraints already cover lookups by tag_id.
+    op.create_index('ix_artist_tags_artist_id_tag_id', 'artist_tags', ['artist_id', 'tag_id'], unique=False)
+    op.create_index('ix_album_tags_album_id_tag_id', 'album_tags', ['album_id', 'tag_id'], unique=False)
+    op.create_index('ix_tag_user_id_label', 'tag', ['user_id', 'label'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tag_user_id_label', table_name='tag')
+    op.drop_index('ix_album_tags_album_id_tag_id', table_name='album_tags')
+    op.drop_index('ix_artist_tags_artist_id_tag_id', table_name='artist_tags')
@@ -0,0 +1,58 @@
+"""Search index over artist and album names
+
+Revision ID: a7d4e1f09b36
+Revises: f2c8d95e0a37
+Create Date: 2026-10-18 19:02:41.530218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d4e1f09b36'
+down_revision = 'f2c8d95e0a37'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('artist', 'album')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        for table in TABLES:
+            op.execute(
+                f"CREATE VIRTUAL TABLE {table}_search USING fts5("
+                f"name, tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+            )
+            # Filled in one statement; later metadata is indexed as it is
+            # stored.
+            op.execute(
+                f'INSERT INTO {table}_search (rowid, name)'
+                f' SELECT id, spotify_name FROM {table}'
+                f' WHERE spotify_name IS NOT NULL'
+            )
+
+    elif dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in TABLES:
+            op.create_index(
+                f'ix_{table}_spotify_name_trgm', table, ['spotify_name'],
+                unique=False, postgresql_using='gin',
+                postgresql_ops={'spotify_name': 'gin_trgm_ops'},
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        for table in reversed(TABLES):
+            op.execute(f'DROP TABLE {table}_search')
+
+    elif dialect == 'postgresql':
+        for table in reversed(TABLES):
+            op.drop_index(f'ix_{table}_spotify_name_trgm', table_name=table)
@@ -0,0 +1,105 @@
+"""Normalize tag labels
+
+Revision ID: b47e9a1f3c25
+Revises: 8f1d2c4b7a90
+Create Date: 2026-10-18 17:05:41.930518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47e9a1f3c25'
+down_revision = '8f1d2c4b7a90'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 1000
+
+ASSOCIATIONS = (
+    ('artist_tags', 'artist_id'),
+    ('album_tags', 'album_id'),
+)
+
+
+def upgrade():
+    op.add_column('tag', sa.Column('normalized_label', sa.String(length=120), nullable=True))
+    _merge_duplicates()
+    op.create_index('ix_tag_user_id_normalized_label', 'tag', ['user_id', 'normalized_label'], unique=True)
+    # Tags are now looked up by normalized label only.
+    op.drop_index('ix_tag_user_id_label', table_name='tag')
+
+
+def downgrade():
+    op.create_index('ix_tag_user_id_label', 'tag', ['user_id', 'label'], unique=False)
+    op.drop_index('ix_tag_user_id_normalized_label', table_name='tag')
+    with op.batch_alter_table('tag') as batch_op:
+        batch_op.drop_column('normalized_label')
+
+
+def _normalize(label):
+    # Must match Tag.normalize.
+    return ' '.join((label or '').split()).casefold()
+
+
+def _merge_duplicates():
+    connection = op.get_bind()
+    tag = sa.table(
+        'tag',
+        sa.column('id'),
+        sa.column('user_id'),
+        sa.column('label'),
+        sa.column('normalized_label'),
+    )
+
+    keep = {}
+    updates = []
+    merges = []
+    for row in connection.execute(
+            sa.select(tag.c.id, tag.c.user_id, tag.c.label).order_by(tag.c.id)):
+        key = (row.user_id, _normalize(row.label))
+        if key in keep:
+            merges.append({'old_id': row.id, 'new_id': keep[key]})
+        else:
+            keep[key] = row.id
+            updates.append({'tag_id': row.id, 'normalized_label': key[1]})
+
+    update = tag.update() \
+        .where(tag.c.id == sa.bindparam('tag_id')) \
+        .values(normalized_label=sa.bindparam('normalized_label'))
+    for start in range(0, len(updates), BATCH_SIZE):
+        connection.execute(update, updates[start:start + BATCH_SIZE])
+
+    if not merges:
+        return
+
+    # The oldest tag of every duplicate group takes over the associations
+    # of the others, then the others are dropped.
+    tag_merge = op.create_table(
+        'tag_merge',
+        sa.Column('old_id', sa.Integer(), primary_key=True),
+        sa.Column('new_id', sa.Integer(), nullable=False),
+    )
+    for start in range(0, len(merges), BATCH_SIZE):
+        connection.execute(tag_merge.insert(), merges[start:start + BATCH_SIZE])
+
+    for table, item_column in ASSOCIATIONS:
+        connection.execute(sa.text(
+            f'INSERT INTO {table} (tag_id, {item_column})'
+            f' SELECT DISTINCT tag_merge.new_id, {table}.{item_column}'
+            f' FROM {table} JOIN tag_merge ON {table}.tag_id = tag_merge.old_id'
+            f' WHERE NOT EXISTS ('
+            f'  SELECT 1 FROM {table} AS existing'
+            f'  WHERE existing.tag_id = tag_merge.new_id'
+            f'  AND existing.{item_column} = {table}.{item_column})'
+        ))
+        connection.execute(sa.text(
+            f'DELETE FROM {table} WHERE tag_id IN (SELECT old_id FROM tag_merge)'
+        ))
+
+    connection.execute(sa.text(
+        'DELETE FROM tag WHERE id IN (SELECT old_id FROM tag_merge)'
+    ))
+    op.drop_table('tag_merge')
@@ -0,0 +1,56 @@
+"""Import jobs and candidate items
+
+Revision ID: d3a5f60c8e12
+Revises: b47e9a1f3c25
+Create Date: 2026-10-18 17:31:18.225904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a5f60c8e12'
+down_revision = 'b47e9a1f3c25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(length=32), nullable=True),
+    sa.Column('target', sa.String(length=64), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('items', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=256), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_status'), 'job', ['status'], unique=False)
+    op.create_table('album_candidates',
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('album_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['album_id'], ['album.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.UniqueConstraint('user_id', 'album_id', name='unique_album_candidate')
+    )
+    op.create_table('artist_candidates',
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('artist_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.UniqueConstraint('user_id', 'artist_id', name='unique_artist_candidate')
+    )
+
+
+def downgrade():
+    op.drop_table('artist_candidates')
+    op.drop_table('album_candidates')
+    op.drop_index(op.f('ix_job_status'), table_name='job')
+    op.drop_table('job')
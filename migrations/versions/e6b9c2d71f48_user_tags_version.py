@@ -0,0 +1,27 @@
+"""Track a version of every user's tags
+
+Revision ID: e6b9c2d71f48
+Revises: d3a5f60c8e12
+Create Date: 2026-10-18 17:52:36.604719
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b9c2d71f48'
+down_revision = 'd3a5f60c8e12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('tags_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('tags_modified_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('tags_modified_at')
+        batch_op.drop_column('tags_version')
@@ -0,0 +1,84 @@
+"""Per-user item tags summary and tag counts
+
+Revision ID: f2c8d95e0a37
+Revises: e6b9c2d71f48
+Create Date: 2026-10-18 18:14:02.871530
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8d95e0a37'
+down_revision = 'e6b9c2d71f48'
+branch_labels = None
+depends_on = None
+
+
+BATCH_SIZE = 1000
+
+ASSOCIATIONS = (
+    ('artist', 'artist_tags', 'artist_id'),
+    ('album', 'album_tags', 'album_id'),
+)
+
+
+def upgrade():
+    item_tags = op.create_table('item_tags',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=8), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('labels', sa.JSON(), nullable=False),
+    sa.Column('tagged_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'kind', 'item_id')
+    )
+    op.create_index('ix_item_tags_user_id_tagged_at', 'item_tags', ['user_id', 'tagged_at'], unique=False)
+    op.add_column('tag', sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+
+    _backfill(item_tags)
+
+
+def downgrade():
+    with op.batch_alter_table('tag') as batch_op:
+        batch_op.drop_column('item_count')
+    op.drop_index('ix_item_tags_user_id_tagged_at', table_name='item_tags')
+    op.drop_table('item_tags')
+
+
+def _backfill(item_tags):
+    connection = op.get_bind()
+    tagged_at = datetime.utcnow()
+
+    for kind, table, item_column in ASSOCIATIONS:
+        connection.execute(sa.text(
+            f'UPDATE tag SET item_count = item_count + ('
+            f' SELECT COUNT(*) FROM {table} WHERE {table}.tag_id = tag.id)'
+        ))
+
+        # Rows arrive grouped by (user, item), so each summary row is
+        # complete when the next one starts.
+        rows = connection.execute(sa.text(
+            f'SELECT tag.user_id, {table}.{item_column}, tag.label'
+            f' FROM {table} JOIN tag ON tag.id = {table}.tag_id'
+            f' ORDER BY tag.user_id, {table}.{item_column}, tag.id'
+        ))
+
+        batch = []
+        current = None
+        for user_id, item_id, label in rows:
+            if current is None or current['user_id'] != user_id \
+                    or current['item_id'] != item_id:
+                if len(batch) == BATCH_SIZE:
+                    op.bulk_insert(item_tags, batch)
+                    batch = []
+                current = {'user_id': user_id, 'kind': kind, 'item_id': item_id,
+                           'labels': [], 'tagged_at': tagged_at}
+                batch.append(current)
+            current['labels'].append(label)
+
+        if batch:
+            op.bulk_insert(item_tags, batch)
@@ -2,6 +2,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
+from flask_wtf.csrf import CSRFProtect
 from spotitag.config import Config
 
 app = Flask(__name__)
@@ -10,5 +11,9 @@ db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 login = LoginManager(app)
 login.login_view = 'login'
+# Also covers POSTs that do not go through a form, like /import.
+csrf = CSRFProtect(app)
 
-from spotitag import models, routes
+from spotitag import models, routes, instrumentation
+
+instrumentation.init_app(app)
@@ -0,0 +1,132 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from cacheout import LRUCache
+from flask import current_app
+
+
+# Sorts after every character, so prefix + _END bounds the labels that
+# start with prefix.
+_END = '\U0010ffff'
+
+# Prefixes matching more labels than this have their results memoized.
+_WIDE = 256
+
+
+def _best(entries, limit):
+    # Ties keep alphabetical order.
+    best = heapq.nlargest(limit, entries, key=lambda entry: entry[1])
+    return [(label, count) for label, count in best if count > 0]
+
+
+class PrefixIndex:
+    # A user's tag labels, kept sorted by normalized label so that all
+    # labels starting with a prefix are one contiguous slice.
+
+    def __init__(self, version, tags):
+        self.version = version
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__keys_by_id = {}
+        for tag_id, label, key, count in tags:
+            self.__entries[key] = [label, count]
+            self.__keys_by_id[tag_id] = key
+        self.__keys = sorted(self.__entries)
+        self.__wide = {}
+
+    def complete(self, prefix, limit):
+        with self.__lock:
+            start = bisect_left(self.__keys, prefix)
+            end = bisect_left(self.__keys, prefix + _END, start)
+            if end - start <= _WIDE:
+                entries = [self.__entries[key] for key in self.__keys[start:end]]
+                return _best(entries, limit)
+
+            # Short prefixes match a good part of the index; their
+            # results are kept until the next edit.
+            best = self.__wide.get((prefix, limit))
+            if best is None:
+                entries = [self.__entries[key] for key in self.__keys[start:end]]
+                best = self.__wide[(prefix, limit)] = _best(entries, limit)
+            return best
+
+    def update(self, version, tags, amounts):
+        # Applies one edit: tags are (id, label, normalized label) of any
+        # tags the edit may have created, amounts maps tag IDs to the
+        # change in their item counts. Returns False when the index does
+        # not hold everything the edit refers to.
+        with self.__lock:
+            self.__wide.clear()
+            for tag_id, label, key in tags:
+                if key not in self.__entries:
+                    self.__entries[key] = [label, 0]
+                    insort(self.__keys, key)
+                self.__keys_by_id[tag_id] = key
+
+            for tag_id, amount in amounts.items():
+                key = self.__keys_by_id.get(tag_id)
+                if key is None:
+                    return False
+                self.__entries[key][1] += amount
+
+            self.version = version
+        return True
+
+
+class TagIndexes:
+    # Per-process indexes of recently active users. An index is only used
+    # at the tags version it was built or last updated for; edits made
+    # by other processes show up as a newer version and force a rebuild.
+
+    def __init__(self, maxsize):
+        self.__indexes = LRUCache(maxsize=maxsize)
+        self.__lock = threading.Lock()
+        self.__stats = {'builds': 0, 'updates': 0, 'hits': 0}
+
+    def get(self, user_id, version):
+        index = self.__indexes.get(user_id)
+        if index is None or index.version != version:
+            return None
+        self.__count('hits')
+        return index
+
+    def put(self, user_id, index):
+        self.__count('builds')
+        self.__indexes.set(user_id, index)
+
+    def update(self, user_id, version, tags, amounts):
+        index = self.__indexes.get(user_id)
+        if index is None:
+            return
+        # Anything but the version right before this edit means another
+        # edit was missed.
+        if index.version != version - 1 or not index.update(version, tags, amounts):
+            self.__indexes.delete(user_id)
+            return
+        self.__count('updates')
+
+    def forget(self, user_id):
+        # For edits whose effect on the counts is not known.
+        self.__indexes.delete(user_id)
+
+    def stats(self):
+        with self.__lock:
+            return {**self.__stats, 'users': self.__indexes.size()}
+
+    def __count(self, name):
+        with self.__lock:
+            self.__stats[name] += 1
+
+
+_indexes = None
+_indexes_lock = threading.Lock()
+
+
+def tag_indexes():
+    global _indexes
+    if _indexes is None:
+        with _indexes_lock:
+            if _indexes is None:
+                _indexes = TagIndexes(current_app.config['AUTOCOMPLETE_USERS'])
+    return _indexes
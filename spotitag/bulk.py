@@ -0,0 +1,221 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from sqlalchemy import select
+
+from spotitag import db, jobs
+from spotitag.models import (
+    Artist, Album, Tag, artist_tags, album_tags, insert_ignore)
+
+
+FORMATS = ('jsonl', 'csv')
+
+CSV_FIELDS = ('kind', 'spotify_id', 'tags')
+
+# kind: (model, association, association item column)
+KINDS = {
+    'artist': (Artist, artist_tags, artist_tags.c.artist_id),
+    'album': (Album, album_tags, album_tags.c.album_id),
+}
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.records = 0
+        self.associations = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        return {
+            'records': self.records,
+            'associations': self.associations,
+            'seconds': round(self.seconds, 3),
+            'records_per_second': round(self.records / self.seconds) if self.seconds else 0,
+        }
+
+
+def format_for(filename, default='jsonl'):
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_records(lines, fmt):
+    # Yields (kind, spotify_id, labels) one line at a time.
+    if fmt not in FORMATS:
+        raise BulkFormatError(f'Unknown format {fmt!r}')
+
+    if fmt == 'csv':
+        rows = csv.DictReader(lines)
+        for number, row in enumerate(rows, start=2):
+            yield _record(number, row.get('kind'), row.get('spotify_id'),
+                          (row.get('tags') or '').split(';'))
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            raise BulkFormatError(f'Line {number}: {error}') from None
+        if not isinstance(row, dict):
+            raise BulkFormatError(f'Line {number}: expected an object')
+
+        tags = row.get('tags') or []
+        if isinstance(tags, str):
+            tags = tags.split(';')
+        yield _record(number, row.get('kind'), row.get('spotify_id'), tags)
+
+
+def _record(number, kind, spotify_id, tags):
+    # JSON values may be of any type; CSV ones are always strings.
+    if not isinstance(kind, str) or kind not in KINDS:
+        raise BulkFormatError(f'Line {number}: unknown kind {kind!r}')
+    if not spotify_id:
+        raise BulkFormatError(f'Line {number}: missing spotify_id')
+    if not isinstance(spotify_id, str):
+        raise BulkFormatError(f'Line {number}: spotify_id must be a string')
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise BulkFormatError(f'Line {number}: tags must be a list of strings')
+    try:
+        # URIs and open.spotify.com URLs are accepted as well.
+        spotify_id = jobs.spotify_id(spotify_id)
+    except jobs.JobError as error:
+        raise BulkFormatError(f'Line {number}: {error}') from None
+    return kind, spotify_id, [tag for tag in tags if tag.strip()]
+
+
+def import_records(user, records, batch_size=500, replace=False):
+    stats = ImportStats()
+    records = iter(records)
+
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+
+        try:
+            stats.associations += _import_batch(user, batch, replace)
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.commit()
+        stats.records += len(batch)
+
+    return stats.finish()
+
+
+def _import_batch(user, batch, replace):
+    tags = Tag.get_tags([label for _, _, labels in batch for label in labels], user)
+    tag_ids = {tag.normalized_label: tag.id for tag in tags}
+    changed_tag_ids = set(tag_ids.values())
+
+    associations = 0
+    for kind, (model, association, item_id) in KINDS.items():
+        labels_by_item = {}
+        for record_kind, spotify_id, labels in batch:
+            if record_kind == kind:
+                labels_by_item.setdefault(spotify_id, set()).update(
+                    tag_ids[Tag.normalize(label)] for label in labels)
+        if not labels_by_item:
+            continue
+
+        item_ids = model.upsert_ids(labels_by_item)
+
+        if replace:
+            replaced = association.c.tag_id.in_(
+                select(Tag.id).where(Tag.user_id == user.id))
+            changed_tag_ids.update(
+                tag_id for tag_id, in db.session.query(association.c.tag_id)
+                .filter(item_id.in_(item_ids.values()), replaced)
+                .distinct()
+            )
+            db.session.execute(
+                association.delete()
+                .where(item_id.in_(item_ids.values()), replaced)
+            )
+
+        rows = [
+            {'tag_id': tag_id, item_id.name: item_ids[spotify_id]}
+            for spotify_id, item_tag_ids in labels_by_item.items()
+            for tag_id in item_tag_ids
+        ]
+        if rows:
+            db.session.execute(insert_ignore(association), rows)
+        associations += len(rows)
+        user.refresh_item_tags(kind, item_ids.values())
+
+    Tag.refresh_item_counts(changed_tag_ids)
+    user.bump_tags_version()
+    return associations
+
+
+def export_records(user, batch_size=500):
+    # Pages through the user's tagged items by id so that only one page
+    # is held in memory at a time.
+    for kind, (model, association, item_id) in KINDS.items():
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, model.spotify_id, Tag.label) \
+                .join(association, item_id == model.id) \
+                .join(Tag, Tag.id == association.c.tag_id) \
+                .filter(Tag.user_id == user.id, model.id.in_(
+                    select(item_id)
+                    .join(Tag, Tag.id == association.c.tag_id)
+                    .where(Tag.user_id == user.id, item_id > last_id)
+                    .order_by(item_id)
+                    .distinct()
+                    .limit(batch_size)
+                    .scalar_subquery())) \
+                .order_by(model.id, Tag.id) \
+                .all()
+            if not rows:
+                break
+
+            spotify_id, labels = None, []
+            for row in rows:
+                if row.spotify_id != spotify_id and labels:
+                    yield kind, spotify_id, labels
+                    labels = []
+                spotify_id = row.spotify_id
+                labels.append(row.label)
+            yield kind, spotify_id, labels
+
+            last_id = rows[-1].id
+
+
+def write_records(records, fmt):
+    # Yields the serialized records as text chunks.
+    if fmt not in FORMATS:
+        raise BulkFormatError(f'Unknown format {fmt!r}')
+
+    if fmt == 'jsonl':
+        for kind, spotify_id, labels in records:
+            yield json.dumps({'kind': kind, 'spotify_id': spotify_id, 'tags': labels}) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for kind, spotify_id, labels in records:
+        writer.writerow((kind, spotify_id, ';'.join(labels)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Only the header when there was nothing to export.
+    if buffer.getvalue():
+        yield buffer.getvalue()
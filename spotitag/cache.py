@@ -0,0 +1,290 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cacheout import FIFOCache, LRUCache
+from flask import current_app
+
+from spotitag.instrumentation import record_cache
+
+
+_MISSING = object()
+
+# SQLite refuses statements with too many bound parameters.
+_MAX_PARAMS = 500
+
+
+class CacheBackend:
+
+    def get_many(self, keys):
+        raise NotImplementedError
+
+    def set_many(self, mapping, ttl=None):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl=ttl)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+
+class MemoryCache(CacheBackend):
+
+    def __init__(self, maxsize, ttl, eviction='lru'):
+        cache_class = LRUCache if eviction == 'lru' else FIFOCache
+        self.__cache = cache_class(maxsize=maxsize, ttl=ttl)
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.__cache.get(key, default=_MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        self.__cache.set_many(mapping, ttl=ttl)
+
+    def delete_many(self, keys):
+        self.__cache.delete_many(list(keys))
+
+    def clear(self):
+        self.__cache.clear()
+
+
+class _SharedConnection:
+    # One connection to a cache file per process, shared by its threads
+    # and greenlets in turn. sqlite3 connections cannot survive a fork.
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = None
+        self.__pid = None
+
+    def __enter__(self):
+        self.__lock.acquire()
+        try:
+            if self.__pid != os.getpid():
+                self.__connection = self.__open()
+                self.__pid = os.getpid()
+        except BaseException:
+            self.__lock.release()
+            raise
+        return self.__connection
+
+    def __exit__(self, *exc_info):
+        self.__lock.release()
+
+    def __open(self):
+        connection = sqlite3.connect(
+            self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            ' namespace TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' value TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL,'
+            ' PRIMARY KEY (namespace, key))'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_cache_accessed_at'
+            ' ON cache (namespace, accessed_at)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_cache_created_at'
+            ' ON cache (namespace, created_at)'
+        )
+        return connection
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _shared_connection(path):
+    with _connections_lock:
+        if path not in _connections:
+            _connections[path] = _SharedConnection(path)
+        return _connections[path]
+
+
+class SQLiteCache(CacheBackend):
+
+    def __init__(self, path, namespace, maxsize, ttl, eviction='lru'):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.eviction = eviction
+        self.__connection = _shared_connection(path)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        now = time.time()
+        found = {}
+
+        with self.__connection as connection:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                rows = connection.execute(
+                    f'SELECT key, value FROM cache'
+                    f' WHERE namespace = ? AND expires_at > ?'
+                    f' AND key IN ({placeholders})',
+                    [self.namespace, now, *chunk],
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+
+                if self.eviction == 'lru' and rows:
+                    hits = [key for key, _ in rows]
+                    connection.execute(
+                        f'UPDATE cache SET accessed_at = ?'
+                        f' WHERE namespace = ?'
+                        f' AND key IN ({",".join("?" * len(hits))})',
+                        [now, self.namespace, *hits],
+                    )
+
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        if not mapping:
+            return
+
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+
+        with self.__connection as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache'
+                ' (namespace, key, value, expires_at, created_at, accessed_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (self.namespace, key, json.dumps(value),
+                     expires_at, now, now)
+                    for key, value in mapping.items()
+                ],
+            )
+            self.__evict(connection, now)
+
+    def __evict(self, connection, now):
+        connection.execute(
+            'DELETE FROM cache WHERE namespace = ? AND expires_at <= ?',
+            (self.namespace, now),
+        )
+
+        size, = connection.execute(
+            'SELECT COUNT(*) FROM cache WHERE namespace = ?',
+            (self.namespace,),
+        ).fetchone()
+        if size <= self.maxsize:
+            return
+
+        order = 'accessed_at' if self.eviction == 'lru' else 'created_at'
+        connection.execute(
+            f'DELETE FROM cache WHERE namespace = ? AND key IN ('
+            f' SELECT key FROM cache WHERE namespace = ?'
+            f' ORDER BY {order} LIMIT ?)',
+            (self.namespace, self.namespace, size - self.maxsize),
+        )
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        with self.__connection as connection:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                connection.execute(
+                    f'DELETE FROM cache WHERE namespace = ?'
+                    f' AND key IN ({",".join("?" * len(chunk))})',
+                    [self.namespace, *chunk],
+                )
+
+    def clear(self):
+        with self.__connection as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+
+
+class _InstrumentedCache(CacheBackend):
+
+    def __init__(self, namespace, backend):
+        self.namespace = namespace
+        self.backend = backend
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = self.backend.get_many(keys)
+        record_cache(self.namespace, hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        self.backend.set_many(mapping, ttl=ttl)
+
+    def delete_many(self, keys):
+        self.backend.delete_many(keys)
+
+    def clear(self):
+        self.backend.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _setting(config, namespace, name):
+    return config.get(f'CACHE_{namespace.upper()}_{name}', config[f'CACHE_{name}'])
+
+
+def _cache_path(config):
+    if config['CACHE_PATH']:
+        return config['CACHE_PATH']
+
+    # Keep the file out of the shared temp directory, where anyone could
+    # create it first and feed us their own entries.
+    os.makedirs(current_app.instance_path, mode=0o700, exist_ok=True)
+    return os.path.join(current_app.instance_path, 'cache.sqlite3')
+
+
+def _build_cache(namespace):
+    config = current_app.config
+    maxsize = _setting(config, namespace, 'MAXSIZE')
+    ttl = _setting(config, namespace, 'TTL')
+    eviction = config['CACHE_EVICTION']
+    backend = _setting(config, namespace, 'BACKEND')
+
+    if backend == 'memory':
+        return MemoryCache(maxsize=maxsize, ttl=ttl, eviction=eviction)
+
+    if backend == 'sqlite':
+        return SQLiteCache(
+            _cache_path(config), namespace,
+            maxsize=maxsize, ttl=ttl, eviction=eviction,
+        )
+
+    raise ValueError(f'Unknown cache backend {backend!r}')
+
+
+def get_cache(namespace):
+    if namespace not in _caches:
+        with _caches_lock:
+            if namespace not in _caches:
+                _caches[namespace] = _InstrumentedCache(
+                    namespace, _build_cache(namespace))
+    return _caches[namespace]
@@ -4,3 +4,68 @@ class Config(object):
     SECRET_KEY = os.environ['SPOTITAG_SECRET_KEY']
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1/')
+    SPOTIFY_TOKEN_URL = os.environ.get(
+        'SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+    SPOTIFY_POOL_SIZE = int(os.environ.get('SPOTIFY_POOL_SIZE', 10))
+    SPOTIFY_TIMEOUT = float(os.environ.get('SPOTIFY_TIMEOUT', 5))
+    SPOTIFY_FANOUT_WORKERS = int(os.environ.get('SPOTIFY_FANOUT_WORKERS', 8))
+    SPOTIFY_FANOUT_LIMIT = int(os.environ.get('SPOTIFY_FANOUT_LIMIT', 4))
+    SPOTIFY_FANOUT_TIMEOUT = float(os.environ.get('SPOTIFY_FANOUT_TIMEOUT', 10))
+    SPOTIFY_BATCH_WINDOW = float(os.environ.get('SPOTIFY_BATCH_WINDOW', 0.005))
+    SPOTIFY_RATE_LIMIT = float(os.environ.get('SPOTIFY_RATE_LIMIT', 10))
+    SPOTIFY_RATE_BURST = int(os.environ.get('SPOTIFY_RATE_BURST', 20))
+    SPOTIFY_MAX_RETRIES = int(os.environ.get('SPOTIFY_MAX_RETRIES', 3))
+    SPOTIFY_MAX_RETRY_AFTER = float(os.environ.get('SPOTIFY_MAX_RETRY_AFTER', 10))
+
+    # A gevent worker would stall all of its requests while one of them
+    # waits on the SQLite cache file.
+    CACHE_BACKEND = os.environ.get(
+        'SPOTITAG_CACHE_BACKEND',
+        'memory' if 'gevent' in os.environ.get('SPOTITAG_WORKER_CLASS', '') else 'sqlite',
+    )
+    # Defaults to a file in the app's instance folder.
+    CACHE_PATH = os.environ.get('SPOTITAG_CACHE_PATH')
+    CACHE_MAXSIZE = int(os.environ.get('SPOTITAG_CACHE_MAXSIZE', 4096))
+    CACHE_TTL = int(os.environ.get('SPOTITAG_CACHE_TTL', 3600))
+    CACHE_EVICTION = os.environ.get('SPOTITAG_CACHE_EVICTION', 'lru')
+    CACHE_SEARCH_TTL = int(os.environ.get('SPOTITAG_CACHE_SEARCH_TTL', 6 * 3600))
+    CACHE_SEARCH_EMPTY_TTL = int(os.environ.get('SPOTITAG_CACHE_SEARCH_EMPTY_TTL', 300))
+    CACHE_ARTIST_ALBUMS_TTL = int(os.environ.get('SPOTITAG_CACHE_ARTIST_ALBUMS_TTL', 24 * 3600))
+    CACHE_USER_TTL = int(os.environ.get('SPOTITAG_CACHE_USER_TTL', 60))
+    # Usernames and email addresses stay out of the shared cache file.
+    CACHE_USER_BACKEND = 'memory'
+
+    METADATA_MAX_AGE_HOURS = int(os.environ.get('SPOTITAG_METADATA_MAX_AGE_HOURS', 24 * 7))
+    METADATA_REFRESH_INTERVAL = int(os.environ.get('SPOTITAG_METADATA_REFRESH_INTERVAL', 600))
+
+    TAGS_PER_PAGE = int(os.environ.get('SPOTITAG_TAGS_PER_PAGE', 25))
+    RECENTLY_TAGGED = int(os.environ.get('SPOTITAG_RECENTLY_TAGGED', 10))
+    TAGS_STREAM = os.environ.get('SPOTITAG_TAGS_STREAM', '0') == '1'
+    JOB_POLL_INTERVAL = float(os.environ.get('SPOTITAG_JOB_POLL_INTERVAL', 2))
+    JOB_TIMEOUT = int(os.environ.get('SPOTITAG_JOB_TIMEOUT', 3600))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('SPOTITAG_JOB_MAX_ATTEMPTS', 3))
+    CANDIDATES_PER_PAGE = int(os.environ.get('SPOTITAG_CANDIDATES_PER_PAGE', 50))
+
+    BULK_BATCH_SIZE = int(os.environ.get('SPOTITAG_BULK_BATCH_SIZE', 500))
+    QUERY_RESULTS_PER_PAGE = int(os.environ.get('SPOTITAG_QUERY_RESULTS_PER_PAGE', 50))
+
+    SEARCH_LOCAL = os.environ.get('SPOTITAG_SEARCH_LOCAL', '1') == '1'
+    SEARCH_LOCAL_RESULTS = int(os.environ.get('SPOTITAG_SEARCH_LOCAL_RESULTS', 20))
+    SEARCH_MERGE_WORKERS = int(os.environ.get('SPOTITAG_SEARCH_MERGE_WORKERS', 2))
+
+    AUTOCOMPLETE_USERS = int(os.environ.get('SPOTITAG_AUTOCOMPLETE_USERS', 1000))
+    AUTOCOMPLETE_RESULTS = int(os.environ.get('SPOTITAG_AUTOCOMPLETE_RESULTS', 10))
+
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('SPOTITAG_FRAGMENT_CACHE_SIZE', 10000))
+
+    HTTP_CACHE_VERSION = os.environ.get('SPOTITAG_HTTP_CACHE_VERSION', '1')
+    RESULT_MAX_AGE = int(os.environ.get('SPOTITAG_RESULT_MAX_AGE', 300))
+    RESULT_SHARED_MAX_AGE = int(os.environ.get('SPOTITAG_RESULT_SHARED_MAX_AGE', 3600))
+
+    # Per worker process; see passwords._Hasher.
+    PASSWORD_HASH_WORKERS = int(os.environ.get('SPOTITAG_PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('SPOTITAG_PASSWORD_HASH_QUEUE', 8))
+
+    METRICS_LOG = os.environ.get('SPOTITAG_METRICS_LOG', '1') == '1'
+    DEBUG_METRICS = os.environ.get('SPOTITAG_DEBUG_METRICS', '0') == '1'
@@ -1,6 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, PasswordField, BooleanField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
+from wtforms import StringField, SubmitField, PasswordField, BooleanField, SelectField
+from wtforms.validators import DataRequired, Email, EqualTo
+from sqlalchemy import or_
+from spotitag import db
+from spotitag.instrumentation import timed
 from spotitag.models import User
 
 
@@ -14,6 +17,22 @@ class EditForm(FlaskForm):
     submit = SubmitField('Update tags')
 
 
+class TagQueryForm(FlaskForm):
+    q = StringField('Tags', validators=[DataRequired()])
+    kind = SelectField(
+        'Find', choices=[('artists', 'Artists'), ('albums', 'Albums')],
+        default='artists')
+    submit = SubmitField('Query')
+
+
+class ImportForm(FlaskForm):
+    kind = SelectField(
+        'Import', choices=[('discography', "An artist's discography"),
+                           ('playlist', 'A playlist')])
+    target = StringField('Spotify link or ID', validators=[DataRequired()])
+    submit = SubmitField('Import')
+
+
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -29,12 +48,23 @@ class RegistrationForm(FlaskForm):
         'Repeat Password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Register')
 
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different username.')
+    def validate(self):
+        if not super().validate():
+            return False
+        return self.validate_available()
+
+    def validate_available(self):
+        # Both fields in one query. The unique constraints have the final
+        # say when two people register at once.
+        with timed('registration_check'):
+            taken = db.session.query(User.username, User.email).filter(or_(
+                User.username == self.username.data,
+                User.email == self.email.data,
+            )).all()
 
-    def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different email address.')
+        for username, email in taken:
+            if username == self.username.data:
+                self.username.errors.append('Please use a different username.')
+            if email == self.email.data:
+                self.email.errors.append('Please use a different email address.')
+        return not taken
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from cacheout import LRUCache
+from flask import current_app, get_template_attribute
+
+from spotitag.instrumentation import record_cache
+
+
+class FragmentCache:
+
+    def __init__(self, maxsize):
+        self.__cache = LRUCache(maxsize=maxsize)
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'render_seconds': 0.0}
+
+    def get_or_render(self, key, render):
+        html = self.__cache.get(key)
+        if html is not None:
+            self.__count(hits=1)
+            return html
+
+        start = time.perf_counter()
+        html = render()
+        self.__count(misses=1, render_seconds=time.perf_counter() - start)
+        self.__cache.set(key, html)
+        return html
+
+    def stats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+
+        lookups = stats['hits'] + stats['misses']
+        average = stats['render_seconds'] / stats['misses'] if stats['misses'] else 0
+        return {
+            **stats,
+            'size': self.__cache.size(),
+            'hit_ratio': stats['hits'] / lookups if lookups else 0,
+            # Estimated from the average time a miss took to render.
+            'saved_seconds': stats['hits'] * average,
+        }
+
+    def __count(self, hits=0, misses=0, render_seconds=0.0):
+        with self.__lock:
+            self.__stats['hits'] += hits
+            self.__stats['misses'] += misses
+            self.__stats['render_seconds'] += render_seconds
+        record_cache('fragment', hits=hits, misses=misses)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_macros = {}
+
+
+def fragment_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = FragmentCache(current_app.config['FRAGMENT_CACHE_SIZE'])
+    return _cache
+
+
+def _macro(template_name):
+    # Resolved once per process, unless templates are being edited.
+    if current_app.templates_auto_reload:
+        return get_template_attribute(template_name, 'render')
+
+    macro = _macros.get(template_name)
+    if macro is None:
+        macro = _macros[template_name] = get_template_attribute(template_name, 'render')
+    return macro
+
+
+def render_item(item, template_name):
+    macro = _macro(template_name)
+
+    # Items whose details could not be loaded render placeholders, which
+    # are not worth keeping.
+    if item.fetched_at is None:
+        return macro(item)
+
+    key = (item.__tablename__, item.spotify_id, item.fetched_at.isoformat())
+    return fragment_cache().get_or_render(key, lambda: macro(item))
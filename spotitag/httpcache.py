@@ -0,0 +1,79 @@
+import hashlib
+from functools import wraps
+
+from flask import request, make_response, current_app
+from flask_login import current_user
+
+from spotitag.loader import metadata_loader
+
+
+def _tags_etag():
+    # Pages built from the tag library change only when its version does,
+    # but also differ per URL and per deploy.
+    key = '\0'.join((
+        str(current_user.id),
+        str(current_user.tags_version),
+        request.full_path,
+        current_app.config['HTTP_CACHE_VERSION'],
+    ))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(
+        last_modified and request.if_modified_since
+        and request.if_modified_since >= last_modified.replace(microsecond=0)
+    )
+
+
+def conditional_on_tags(view):
+    # Answers conditional requests with a 304 before the view runs.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = _tags_etag()
+        last_modified = current_user.tags_modified_at
+
+        if _not_modified(etag, last_modified):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed \
+                    or metadata_loader().incomplete:
+                # Placeholders for failed lookups should not be revalidated
+                # as current.
+                return response
+
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+
+    return wrapper
+
+
+def cache_publicly(view):
+    # Search results only depend on the query, but the page header shows
+    # who is logged in.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or metadata_loader().incomplete:
+            return response
+
+        config = current_app.config
+        if current_user.is_anonymous:
+            response.cache_control.public = True
+            response.cache_control.s_maxage = config['RESULT_SHARED_MAX_AGE']
+        else:
+            response.cache_control.private = True
+        response.cache_control.max_age = config['RESULT_MAX_AGE']
+        response.vary.add('Cookie')
+
+        response.add_etag(weak=True)
+        return response.make_conditional(request)
+
+    return wrapper
@@ -0,0 +1,302 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+from flask import g, request, Response, abort, before_render_template, template_rendered
+from flask.logging import default_handler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger('spotitag.metrics')
+
+_current = ContextVar('spotitag_request_metrics', default=None)
+
+_SPOTIFY_RESOURCES = {
+    'albums', 'artists', 'playlists', 'search', 'tracks', 'me', 'top-tracks',
+    'related-artists',
+}
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slowest_query_seconds = 0.0
+        self.spotify = defaultdict(lambda: [0, 0.0])
+        self.cache = defaultdict(lambda: [0, 0])
+        self.render_seconds = 0.0
+        self.timings = defaultdict(float)
+        # Spotify lookups of one request run on several pool threads.
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'duration_ms': _ms(time.perf_counter() - self.started),
+                'queries': self.queries,
+                'query_ms': _ms(self.query_seconds),
+                'slowest_query_ms': _ms(self.slowest_query_seconds),
+                'spotify': {
+                    endpoint: {'calls': calls, 'ms': _ms(seconds)}
+                    for endpoint, (calls, seconds) in self.spotify.items()
+                },
+                'cache': {
+                    namespace: {'hits': hits, 'misses': misses}
+                    for namespace, (hits, misses) in self.cache.items()
+                },
+                'render_ms': _ms(self.render_seconds),
+                'timings_ms': {
+                    name: _ms(seconds) for name, seconds in self.timings.items()
+                },
+            }
+
+    def server_timing(self):
+        with self.lock:
+            spotify_calls = sum(calls for calls, _ in self.spotify.values())
+            spotify_seconds = sum(seconds for _, seconds in self.spotify.values())
+            hits = sum(hits for hits, _ in self.cache.values())
+            misses = sum(misses for _, misses in self.cache.values())
+
+            entries = [
+                f'db;dur={_ms(self.query_seconds)};desc="{self.queries} queries"',
+                f'spotify;dur={_ms(spotify_seconds)};desc="{spotify_calls} calls"',
+                f'render;dur={_ms(self.render_seconds)}',
+                f'cache;desc="{hits} hits, {misses} misses"',
+            ]
+            entries.extend(
+                f'{name.replace(".", "-")};dur={_ms(seconds)}'
+                for name, seconds in self.timings.items()
+            )
+            entries.append(
+                f'total;dur={_ms(time.perf_counter() - self.started)}')
+
+        return ', '.join(entries)
+
+
+class _Registry:
+
+    def __init__(self):
+        self.__counters = defaultdict(float)
+        self.__lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] += amount
+
+    def samples(self):
+        with self.__lock:
+            return dict(self.__counters)
+
+
+registry = _Registry()
+
+
+def record_query(seconds):
+    registry.inc('spotitag_sql_queries_total')
+    registry.inc('spotitag_sql_seconds_total', seconds)
+
+    metrics = _current.get()
+    if metrics is None:
+        return
+    with metrics.lock:
+        metrics.queries += 1
+        metrics.query_seconds += seconds
+        metrics.slowest_query_seconds = max(metrics.slowest_query_seconds, seconds)
+
+
+def record_spotify_call(url, prefix, seconds):
+    endpoint = _spotify_endpoint(url, prefix)
+    registry.inc('spotitag_spotify_calls_total', endpoint=endpoint)
+    registry.inc('spotitag_spotify_seconds_total', seconds, endpoint=endpoint)
+
+    metrics = _current.get()
+    if metrics is None:
+        return
+    with metrics.lock:
+        metrics.spotify[endpoint][0] += 1
+        metrics.spotify[endpoint][1] += seconds
+
+
+def record_cache(namespace, hits, misses):
+    registry.inc('spotitag_cache_hits_total', hits, namespace=namespace)
+    registry.inc('spotitag_cache_misses_total', misses, namespace=namespace)
+
+    metrics = _current.get()
+    if metrics is None:
+        return
+    with metrics.lock:
+        metrics.cache[namespace][0] += hits
+        metrics.cache[namespace][1] += misses
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.inc('spotitag_step_seconds_total', seconds, step=name)
+        registry.inc('spotitag_step_total', step=name)
+
+        metrics = _current.get()
+        if metrics is not None:
+            with metrics.lock:
+                metrics.timings[name] += seconds
+
+
+def _spotify_endpoint(url, prefix):
+    path = url.split('?')[0]
+    if path.startswith(prefix):
+        path = path[len(prefix):]
+    else:
+        path = urlparse(path).path.split('/v1/')[-1]
+
+    return '/'.join(
+        segment if segment in _SPOTIFY_RESOURCES else '{id}'
+        for segment in path.split('/') if segment
+    )
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+# The start time lives on the execution context, which is discarded when a
+# statement fails. Only statements run without a context fall back to a
+# stack on the connection, unwound again in _handle_error.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = time.perf_counter()
+    if context is not None:
+        context.query_started = started
+    else:
+        conn.info.setdefault('query_started', []).append(started)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        started = context.query_started
+    else:
+        started = conn.info['query_started'].pop()
+    record_query(time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if (
+        conn is not None
+        and exception_context.execution_context is None
+        and exception_context.cursor is not None
+        and conn.info.get('query_started')
+    ):
+        conn.info['query_started'].pop()
+
+
+def init_app(app):
+    if app.config['METRICS_LOG']:
+        logger.setLevel(logging.INFO)
+        if not logger.handlers:
+            logger.addHandler(default_handler)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_token = _current.set(RequestMetrics())
+
+    @app.after_request
+    def add_server_timing(response):
+        metrics = _current.get()
+        if metrics is not None:
+            response.headers['Server-Timing'] = metrics.server_timing()
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error=None):
+        token = g.pop('metrics_token', None)
+        if token is None:
+            return
+
+        metrics = _current.get()
+        _current.reset(token)
+
+        endpoint = request.endpoint or 'unknown'
+        summary = metrics.as_dict()
+        registry.inc('spotitag_requests_total', endpoint=endpoint)
+        registry.inc('spotitag_request_seconds_total',
+                     summary['duration_ms'] / 1000, endpoint=endpoint)
+        registry.inc('spotitag_render_seconds_total',
+                     summary['render_ms'] / 1000, endpoint=endpoint)
+
+        if not app.config['METRICS_LOG']:
+            return
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            **summary,
+        }))
+
+    def start_render(sender, template, context, **extra):
+        g.render_started = time.perf_counter()
+
+    def finish_render(sender, template, context, **extra):
+        metrics = _current.get()
+        started = g.pop('render_started', None)
+        if metrics is not None and started is not None:
+            with metrics.lock:
+                metrics.render_seconds += time.perf_counter() - started
+
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(finish_render, app, weak=False)
+
+    @app.route('/debug/metrics')
+    def debug_metrics():
+        if not app.config['DEBUG_METRICS']:
+            abort(404)
+        return Response(_prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+def _prometheus_text():
+    from spotitag.autocomplete import tag_indexes
+    from spotitag.fragments import fragment_cache
+    from spotitag.spotify import SpotifyHandler
+
+    handler = SpotifyHandler()
+    gauges = {}
+    for prefix, stats in (
+        ('spotitag_spotify_client', handler.clientStats()),
+        ('spotitag_spotify_scheduler', handler.schedulerStats()),
+        ('spotitag_search_cache', handler.searchCacheStats()),
+        ('spotitag_fragment_cache', fragment_cache().stats()),
+        ('spotitag_tag_index', tag_indexes().stats()),
+    ):
+        for name, value in stats.items():
+            gauges[(f'{prefix}_{name}', ())] = value
+
+    lines = []
+    for kind, samples in (('counter', registry.samples()), ('gauge', gauges)):
+        by_name = defaultdict(list)
+        for (name, labels), value in samples.items():
+            by_name[name].append((labels, value))
+
+        for name in sorted(by_name):
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name[name]):
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                if label_text:
+                    label_text = '{' + label_text + '}'
+                lines.append(f'{name}{label_text} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,160 @@
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from spotitag import db
+from spotitag.models import Job, Artist, Album
+from spotitag.spotify import SpotifyHandler
+
+
+logger = logging.getLogger(__name__)
+
+# Accepts bare IDs, spotify:<kind>:<id> URIs and open.spotify.com URLs.
+_SPOTIFY_ID = re.compile(r'(?:^|[:/])([A-Za-z0-9]{22})(?:$|[?/])')
+
+
+class JobError(ValueError):
+    pass
+
+
+def spotify_id(target):
+    match = _SPOTIFY_ID.search(target.strip())
+    if match is None:
+        raise JobError(f'{target!r} is not a Spotify ID, URI or URL')
+    return match.group(1)
+
+
+def enqueue(user, kind, target):
+    if kind not in _RUNNERS:
+        raise JobError(f'Unknown job kind {kind!r}')
+
+    job = Job(user=user, kind=kind, target=spotify_id(target))
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim_next():
+    # Several workers may poll at once: a job belongs to whoever flips
+    # its status first.
+    while True:
+        job_id = db.session.query(Job.id) \
+            .filter(Job.status == 'queued') \
+            .order_by(Job.id) \
+            .limit(1) \
+            .scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            Job.__table__.update()
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow(),
+                    attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+
+
+def requeue_stale(timeout, max_attempts):
+    # Jobs whose worker died mid-run go back to the queue, up to a point.
+    cutoff = datetime.utcnow() - timeout
+    stale = Job.__table__.update().where(
+        Job.status == 'running', Job.started_at < cutoff)
+
+    db.session.execute(
+        stale.where(Job.attempts < max_attempts).values(status='queued'))
+    db.session.execute(
+        stale.where(Job.attempts >= max_attempts)
+        .values(status='failed', error='Timed out', finished_at=datetime.utcnow()))
+    db.session.commit()
+
+
+def run(job):
+    try:
+        for items in _RUNNERS[job.kind](job):
+            job.items += items
+            # Every page is committed, so progress survives a crash.
+            db.session.commit()
+    except Exception as error:
+        logger.exception('Job %s failed', job.id)
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(error)[:256]
+    else:
+        job.status = 'done'
+        job.error = None
+
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def _store_artists(spotify_ids):
+    # Listings only name artists by ID. The details of those not stored
+    # yet are looked up in batches, so that the candidates page finds
+    # them stored like the albums.
+    stored = dict(
+        db.session.query(Artist.spotify_id, Artist.id)
+        .filter(Artist.spotify_id.in_(spotify_ids), Artist.fetched_at.isnot(None))
+    )
+    missing = [spotify_id for spotify_id in spotify_ids if spotify_id not in stored]
+    details = SpotifyHandler().detailsForArtists(missing)
+
+    artist_ids = dict(stored)
+    artist_ids.update(Artist.store_details(details.values()))
+    # Artists whose lookup failed are loaded when they are shown.
+    artist_ids.update(Artist.upsert_ids(
+        spotify_id for spotify_id in missing if spotify_id not in details))
+    return artist_ids
+
+
+def _run_discography(job):
+    artist_ids = _store_artists([job.target])
+    job.user.add_artist_candidates(artist_ids.values())
+    yield 1
+
+    for albums in SpotifyHandler().artistAlbumPages(job.target):
+        album_ids = Album.store_details(albums)
+        job.user.add_album_candidates(album_ids.values())
+        yield len(album_ids)
+
+
+def _run_playlist(job):
+    for albums, artist_spotify_ids in SpotifyHandler().playlistPages(job.target):
+        album_ids = Album.store_details(albums)
+        artist_ids = _store_artists(artist_spotify_ids)
+        job.user.add_album_candidates(album_ids.values())
+        job.user.add_artist_candidates(artist_ids.values())
+        yield len(album_ids) + len(artist_ids)
+
+
+_RUNNERS = {
+    'discography': _run_discography,
+    'playlist': _run_playlist,
+}
+
+
+def work(once=False):
+    config = current_app.config
+    timeout = timedelta(seconds=config['JOB_TIMEOUT'])
+
+    while True:
+        requeue_stale(timeout, config['JOB_MAX_ATTEMPTS'])
+
+        job = claim_next()
+        if job is not None:
+            logger.info('Running job %s', job.id)
+            run(job)
+            # Nothing from the finished job needs to stay in memory.
+            db.session.expunge_all()
+            continue
+
+        if once:
+            return
+        time.sleep(config['JOB_POLL_INTERVAL'])
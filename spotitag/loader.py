@@ -0,0 +1,33 @@
+from collections import defaultdict
+
+from flask import g
+
+
+class MetadataLoader:
+
+    def __init__(self):
+        self.__pending = defaultdict(dict)
+        self.__attempted = set()
+        # Set once a lookup failed and a placeholder will be rendered.
+        self.incomplete = False
+
+    def prime(self, items):
+        for item in items:
+            key = (type(item), item.spotify_id)
+            if item.fetched_at is None and key not in self.__attempted:
+                self.__pending[type(item)][item.spotify_id] = item
+
+    def load(self):
+        pending, self.__pending = self.__pending, defaultdict(dict)
+        for model, items in pending.items():
+            # Lookups that failed are not retried within the same request.
+            self.__attempted.update((model, spotify_id) for spotify_id in items)
+            model.load_details(list(items.values()))
+            if any(item.fetched_at is None for item in items.values()):
+                self.incomplete = True
+
+
+def metadata_loader():
+    if 'metadata_loader' not in g:
+        g.metadata_loader = MetadataLoader()
+    return g.metadata_loader
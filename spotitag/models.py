@@ -1,11 +1,48 @@
 from flask_login import UserMixin
-from flask import url_for, get_template_attribute
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy.exc import IntegrityError
+from flask import url_for, current_app
+from sqlalchemy import bindparam, event, func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from collections import defaultdict
+from datetime import datetime
 
 from spotitag import db, login
-from spotitag.spotify import SpotifyHandler, _get_artist_details
+from spotitag.cache import get_cache
+from spotitag.instrumentation import timed
+from spotitag.passwords import hash_password, check_password
+from spotitag.spotify import SpotifyHandler, SPOTIFY_ERRORS
+from spotitag.loader import metadata_loader
+from spotitag.fragments import render_item
+from spotitag.autocomplete import PrefixIndex, tag_indexes
+from spotitag.search import (
+    register_index, index_names, search_names, in_background)
+from spotitag.tagquery import parse, compile_query
+
+
+def insert_ignore(table):
+    # An INSERT that silently skips rows violating a unique constraint.
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    return table.insert().prefix_with('IGNORE')
+
+
+def upsert(table, keys, columns):
+    # An INSERT that overwrites the given columns of a row already there
+    # under the same keys.
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={column: statement.excluded[column] for column in columns},
+        )
+    statement = mysql.insert(table)
+    return statement.on_duplicate_key_update(
+        {column: statement.inserted[column] for column in columns})
 
 
 class User(UserMixin, db.Model):
@@ -14,41 +51,40 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(128))
+    # Bumped on every change to the user's tags, for HTTP validators.
+    tags_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tags_modified_at = db.Column(db.DateTime)
     tags = db.relationship('Tag', backref='user', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return check_password(self.password_hash, password)
 
     def __repr__(self):
         return self.username
 
+    def bump_tags_version(self):
+        # Incremented in SQL, so concurrent edits never share a version.
+        # Returns the new version.
+        db.session.execute(
+            User.__table__.update()
+            .where(User.id == self.id)
+            .values(tags_version=User.tags_version + 1,
+                    tags_modified_at=datetime.utcnow())
+        )
+        return db.session.query(User.tags_version) \
+            .filter(User.id == self.id) \
+            .scalar()
+
     def set_artist_tags(self, tag_labels, artist_spotify_id):
-        tags = Tag.get_tags(labels=tag_labels, user=self)
         artist = Artist.get(artist_spotify_id)
+        self.__set_item_tags(tag_labels, 'artist', artist)
 
-        for tag in tags:
-            if artist not in tag.artists.all():
-                tag.artists.append(artist)
-
-        db.session.commit()
-
-        all_artist_tags = set(self.tags_by_artist()[artist])
-        tags_to_remove = all_artist_tags - set(tags)
-        for tag in tags_to_remove:
-            tag.artists.remove(artist)
-
-        db.session.commit()
-
-    def artists_by_tag(self):
-        tag_artists = {
-            tag: list(tag.artists.all())
-            for tag in self.tags.all()
-        }
-
-        return tag_artists
+    def artists_by_tag(self, tags=None):
+        return self.__items_by_tag(
+            Artist, artist_tags, artist_tags.c.artist_id, tags)
 
     def tags_by_artist(self):
         artist_tags = defaultdict(list)
@@ -58,29 +94,229 @@ class User(UserMixin, db.Model):
         return artist_tags
 
     def set_album_tags(self, tag_labels, album_spotify_id):
-        tags = Tag.get_tags(labels=tag_labels, user=self)
         album = Album.get(album_spotify_id)
+        self.__set_item_tags(tag_labels, 'album', album)
 
-        for tag in tags:
-            if album not in tag.albums.all():
-                tag.albums.append(album)
-
-        db.session.commit()
+    def __set_item_tags(self, tag_labels, kind, item):
+        association, item_id = ASSOCIATIONS[kind]
+        tags = Tag.get_tags(labels=tag_labels, user=self)
+        tag_ids = {tag.id for tag in tags}
 
-        all_album_tags = set(self.tags_by_album()[album])
-        tags_to_remove = all_album_tags - set(tags)
-        for tag in tags_to_remove:
-            tag.albums.remove(album)
+        current_tag_ids = {
+            tag_id for tag_id, in db.session.query(association.c.tag_id)
+            .join(Tag, Tag.id == association.c.tag_id)
+            .filter(Tag.user_id == self.id, item_id == item.id)
+        }
 
+        # Whether every statement changed exactly the rows of the diff. A
+        # concurrent edit of the same item may have changed some first.
+        counted = True
+
+        tags_to_add = tag_ids - current_tag_ids
+        if tags_to_add:
+            result = db.session.execute(
+                insert_ignore(association),
+                [{'tag_id': tag_id, item_id.name: item.id} for tag_id in tags_to_add],
+            )
+            counted = counted and result.rowcount == len(tags_to_add)
+
+        tags_to_remove = current_tag_ids - tag_ids
+        if tags_to_remove:
+            result = db.session.execute(
+                association.delete().where(
+                    item_id == item.id,
+                    association.c.tag_id.in_(tags_to_remove),
+                )
+            )
+            counted = counted and result.rowcount == len(tags_to_remove)
+
+        if not tags_to_add and not tags_to_remove:
+            db.session.commit()
+            return
+
+        if counted:
+            Tag.add_to_item_counts(tags_to_add, 1)
+            Tag.add_to_item_counts(tags_to_remove, -1)
+        else:
+            Tag.refresh_item_counts(tags_to_add | tags_to_remove)
+        self.__store_item_tags(
+            kind, {item.id: [tag.label for tag in sorted(tags, key=lambda tag: tag.id)]})
+        version = self.bump_tags_version()
+        # Read before the commit expires them.
+        user_id = self.id
+        tag_rows = [(tag.id, tag.label, tag.normalized_label) for tag in tags]
         db.session.commit()
 
-    def albums_by_tag(self):
-        tag_albums = {
-            tag: list(tag.albums.all())
-            for tag in self.tags.all()
-        }
-
-        return tag_albums
+        if not counted:
+            tag_indexes().forget(user_id)
+            return
+        tag_indexes().update(
+            user_id, version, tag_rows,
+            {**dict.fromkeys(tags_to_add, 1), **dict.fromkeys(tags_to_remove, -1)},
+        )
+
+    def complete_tags(self, prefix, limit):
+        # Labels of the user's tags starting with prefix, most used first.
+        index = tag_indexes().get(self.id, self.tags_version)
+        if index is None:
+            # One statement, so the version matches the counts it is
+            # read with.
+            rows = db.session.query(
+                Tag.id, Tag.label, Tag.normalized_label, Tag.item_count,
+                User.tags_version,
+            ).join(User, User.id == Tag.user_id).filter(User.id == self.id).all()
+            version = rows[0].tags_version if rows else self.tags_version
+            index = PrefixIndex(version, [row[:4] for row in rows])
+            tag_indexes().put(self.id, index)
+        return index.complete(Tag.normalize(prefix), limit)
+
+    def artist_tag_labels(self, artist):
+        return self.__tag_labels('artist', artist)
+
+    def album_tag_labels(self, album):
+        return self.__tag_labels('album', album)
+
+    def __tag_labels(self, kind, item):
+        summary = ItemTags.query.get((self.id, kind, item.id))
+        return summary.labels if summary is not None else []
+
+    def refresh_item_tags(self, kind, item_ids):
+        # Rebuilds the summary rows of the given items from the
+        # association table, for changes made in bulk.
+        association, item_id = ASSOCIATIONS[kind]
+        item_ids = list(item_ids)
+
+        labels = {i: [] for i in item_ids}
+        rows = db.session.query(item_id, Tag.label) \
+            .join(Tag, Tag.id == association.c.tag_id) \
+            .filter(Tag.user_id == self.id, item_id.in_(item_ids)) \
+            .order_by(item_id, Tag.id)
+        for i, label in rows:
+            labels[i].append(label)
+
+        self.__store_item_tags(kind, labels)
+
+    def __store_item_tags(self, kind, labels):
+        untagged = [i for i, item_labels in labels.items() if not item_labels]
+        if untagged:
+            db.session.execute(
+                ItemTags.__table__.delete().where(
+                    ItemTags.user_id == self.id,
+                    ItemTags.kind == kind,
+                    ItemTags.item_id.in_(untagged),
+                )
+            )
+
+        tagged_at = datetime.utcnow()
+        rows = [
+            {'user_id': self.id, 'kind': kind, 'item_id': i,
+             'labels': item_labels, 'tagged_at': tagged_at}
+            for i, item_labels in labels.items() if item_labels
+        ]
+        if rows:
+            # Concurrent edits of the same item both write its row.
+            db.session.execute(
+                upsert(ItemTags.__table__, ('user_id', 'kind', 'item_id'),
+                       ('labels', 'tagged_at')),
+                rows,
+            )
+
+    def recently_tagged(self, limit=10):
+        summaries = ItemTags.query \
+            .filter(ItemTags.user_id == self.id) \
+            .order_by(ItemTags.tagged_at.desc()) \
+            .limit(limit) \
+            .all()
+
+        items = {}
+        for kind, model in (('artist', Artist), ('album', Album)):
+            item_ids = [s.item_id for s in summaries if s.kind == kind]
+            if item_ids:
+                items.update(
+                    ((kind, item.id), item)
+                    for item in model.query.filter(model.id.in_(item_ids)))
+
+        return [(items[(s.kind, s.item_id)], s.labels) for s in summaries]
+
+    def albums_by_tag(self, tags=None):
+        return self.__items_by_tag(
+            Album, album_tags, album_tags.c.album_id, tags)
+
+    def __items_by_tag(self, model, association, item_id, tags=None):
+        rows = db.session.query(Tag, model) \
+            .outerjoin(association, association.c.tag_id == Tag.id) \
+            .outerjoin(model, model.id == item_id) \
+            .filter(Tag.user_id == self.id) \
+            .order_by(Tag.id, model.id)
+
+        if tags is not None:
+            rows = rows.filter(Tag.id.in_([tag.id for tag in tags]))
+
+        items_by_tag = {}
+        for tag, item in rows:
+            items = items_by_tag.setdefault(tag, [])
+            if item is not None:
+                items.append(item)
+
+        return items_by_tag
+
+    def artists_matching(self, expression, after=0, limit=50):
+        return self.__items_matching(
+            Artist, artist_tags, artist_tags.c.artist_id, expression, after, limit)
+
+    def albums_matching(self, expression, after=0, limit=50):
+        return self.__items_matching(
+            Album, album_tags, album_tags.c.album_id, expression, after, limit)
+
+    def __items_matching(self, model, association, item_id, expression, after, limit):
+        item_ids = compile_query(
+            parse(expression), association, item_id, Tag.__table__, self.id,
+            normalize=Tag.normalize)
+
+        items = model.query \
+            .filter(model.id.in_(item_ids), model.id > after) \
+            .order_by(model.id) \
+            .limit(limit + 1) \
+            .all()
+
+        return items[:limit], len(items) > limit
+
+    def tags_page(self, after=0, limit=25):
+        tags = self.tags.filter(Tag.id > after) \
+            .order_by(Tag.id) \
+            .limit(limit + 1) \
+            .all()
+
+        return tags[:limit], len(tags) > limit
+
+    def add_artist_candidates(self, artist_ids):
+        self.__add_candidates(artist_candidates, 'artist_id', artist_ids)
+
+    def add_album_candidates(self, album_ids):
+        self.__add_candidates(album_candidates, 'album_id', album_ids)
+
+    def __add_candidates(self, candidates, item_id, item_ids):
+        rows = [{'user_id': self.id, item_id: i} for i in set(item_ids)]
+        if rows:
+            db.session.execute(insert_ignore(candidates), rows)
+
+    def artist_candidates_page(self, after=0, limit=50):
+        return self.__candidates_page(
+            Artist, artist_candidates, artist_candidates.c.artist_id, after, limit)
+
+    def album_candidates_page(self, after=0, limit=50):
+        return self.__candidates_page(
+            Album, album_candidates, album_candidates.c.album_id, after, limit)
+
+    def __candidates_page(self, model, candidates, item_id, after, limit):
+        items = model.query \
+            .join(candidates, item_id == model.id) \
+            .filter(candidates.c.user_id == self.id, model.id > after) \
+            .order_by(model.id) \
+            .limit(limit + 1) \
+            .all()
+
+        return items[:limit], len(items) > limit
 
     def tags_by_album(self):
         album_tags = defaultdict(list)
@@ -94,6 +330,7 @@ artist_tags = db.Table('artist_tags',
     db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
     db.Column('artist_id', db.Integer, db.ForeignKey('artist.id')),
     db.UniqueConstraint('tag_id', 'artist_id', name='unique_artist_tag'),
+    db.Index('ix_artist_tags_artist_id_tag_id', 'artist_id', 'tag_id'),
 )
 
 
@@ -101,13 +338,59 @@ album_tags = db.Table('album_tags',
     db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
     db.Column('album_id', db.Integer, db.ForeignKey('album.id')),
     db.UniqueConstraint('tag_id', 'album_id', name='unique_album_tag'),
+    db.Index('ix_album_tags_album_id_tag_id', 'album_id', 'tag_id'),
+)
+
+
+# Items imported by background jobs, waiting to be tagged.
+artist_candidates = db.Table('artist_candidates',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id')),
+    db.UniqueConstraint('user_id', 'artist_id', name='unique_artist_candidate'),
+)
+
+
+album_candidates = db.Table('album_candidates',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
+    db.Column('album_id', db.Integer, db.ForeignKey('album.id')),
+    db.UniqueConstraint('user_id', 'album_id', name='unique_album_candidate'),
 )
 
 
+# kind: (association, association item column)
+ASSOCIATIONS = {
+    'artist': (artist_tags, artist_tags.c.artist_id),
+    'album': (album_tags, album_tags.c.album_id),
+}
+
+
+class ItemTags(db.Model):
+    # The labels of one user's tags on one item, so that reading them is
+    # a primary key lookup. Kept in step with the association tables.
+
+    __tablename__ = 'item_tags'
+    __table_args__ = (
+        db.Index('ix_item_tags_user_id_tagged_at', 'user_id', 'tagged_at'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    kind = db.Column(db.String(8), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True)
+    labels = db.Column(db.JSON, nullable=False)
+    tagged_at = db.Column(db.DateTime, nullable=False)
+
+
 class Tag(db.Model):
 
+    __table_args__ = (
+        db.Index('ix_tag_user_id_normalized_label',
+                 'user_id', 'normalized_label', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     label = db.Column(db.String(120), index=True)
+    normalized_label = db.Column(db.String(120))
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
     artists = db.relationship(
@@ -127,108 +410,354 @@ class Tag(db.Model):
     def __repr__(self):
         return self.label
 
-    def __normalize(self, label):
-        return label.lower()
+    @staticmethod
+    def normalize(label):
+        return ' '.join(label.split()).casefold()
+
+    @classmethod
+    def add_to_item_counts(cls, tag_ids, amount):
+        if tag_ids:
+            db.session.execute(
+                cls.__table__.update()
+                .where(cls.id.in_(list(tag_ids)))
+                .values(item_count=cls.item_count + amount)
+            )
+
+    @classmethod
+    def refresh_item_counts(cls, tag_ids):
+        tag_ids = list(tag_ids)
+        if not tag_ids:
+            return
+
+        tag = cls.__table__
+        artist_count = select(func.count()) \
+            .where(artist_tags.c.tag_id == tag.c.id).scalar_subquery()
+        album_count = select(func.count()) \
+            .where(album_tags.c.tag_id == tag.c.id).scalar_subquery()
+        db.session.execute(
+            tag.update()
+            .where(tag.c.id.in_(tag_ids))
+            .values(item_count=artist_count + album_count)
+        )
 
     @classmethod
     def get_tags(cls, labels, user):
-        existing_tags = user.tags.all()
-        existing_labels = [tag.label for tag in existing_tags]
+        # The first spelling of a label is the one that is displayed.
+        labels_by_key = {}
+        for label in labels:
+            label = ' '.join(label.split())
+            if label:
+                labels_by_key.setdefault(cls.normalize(label), label)
+        if not labels_by_key:
+            return []
+
+        db.session.execute(
+            insert_ignore(cls.__table__),
+            [
+                {'label': label, 'normalized_label': key, 'user_id': user.id}
+                for key, label in labels_by_key.items()
+            ],
+        )
+
+        return cls.query.filter(
+            cls.user_id == user.id,
+            cls.normalized_label.in_(labels_by_key),
+        ).all()
+
+
+class SpotifyItemMixin:
+
+    spotify_name = db.Column(db.String(256))
+    spotify_url = db.Column(db.String(256))
+    image_url = db.Column(db.String(256))
+    fetched_at = db.Column(db.DateTime, index=True)
+
+    @classmethod
+    def get(cls, spotify_id):
+        return cls.get_many([spotify_id])[0]
+
+    @classmethod
+    def upsert_ids(cls, spotify_ids):
+        # Returns {spotify_id: id}, creating the missing rows.
+        spotify_ids = list(dict.fromkeys(spotify_ids))
+        if not spotify_ids:
+            return {}
+
+        db.session.execute(
+            insert_ignore(cls.__table__),
+            [{'spotify_id': spotify_id} for spotify_id in spotify_ids],
+        )
+        return dict(
+            db.session.query(cls.spotify_id, cls.id)
+            .filter(cls.spotify_id.in_(spotify_ids))
+        )
+
+    @classmethod
+    def store_details(cls, details):
+        # Upserts items whose Spotify details are already known, for
+        # example from a page of a listing.
+        details = {item['id']: item for item in details}
+        item_ids = cls.upsert_ids(details)
+        if not item_ids:
+            return item_ids
+
+        fetched_at = datetime.utcnow()
+        table = cls.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('item_id')),
+            [
+                {
+                    'item_id': item_ids[spotify_id],
+                    'spotify_name': item['name'],
+                    'spotify_url': item['url'],
+                    'image_url': item['image'],
+                    'fetched_at': fetched_at,
+                }
+                for spotify_id, item in details.items()
+            ],
+        )
+        index_names(db.session.execute, table, {
+            item_ids[spotify_id]: item['name'] for spotify_id, item in details.items()
+        })
+        return item_ids
+
+    @classmethod
+    def search_local(cls, query, limit):
+        # Items already known under that name, or None when the database
+        # has no search index.
+        item_ids = search_names(cls.__table__, query, limit)
+        if not item_ids:
+            return item_ids
 
-        tags = [tag for tag in existing_tags if tag.label in labels]
+        items = {item.id: item for item in cls.query.filter(cls.id.in_(item_ids))}
+        return [items[item_id] for item_id in item_ids if item_id in items]
 
-        new_labels = set(labels) - set(existing_labels)
-        for label in new_labels:
-            tag = cls(label=label, user=user)
-            db.session.add(tag)
-            tags.append(tag)
+    @classmethod
+    def get_many(cls, spotify_ids):
+        spotify_ids = list(dict.fromkeys(spotify_ids))
+        if not spotify_ids:
+            return []
+
+        db.session.execute(
+            insert_ignore(cls.__table__),
+            [{'spotify_id': spotify_id} for spotify_id in spotify_ids],
+        )
         db.session.commit()
 
-        return tags
+        items = {
+            item.spotify_id: item
+            for item in cls.query.filter(cls.spotify_id.in_(spotify_ids))
+        }
+        return [items[spotify_id] for spotify_id in spotify_ids]
+
+    def name(self):
+        self.__ensure_details()
+        return self.spotify_name or self.spotify_id
+
+    def spotifyURL(self):
+        self.__ensure_details()
+        return self.spotify_url or \
+            f'https://open.spotify.com/{self.__tablename__}/{self.spotify_id}'
+
+    def image(self):
+        self.__ensure_details()
+        return self.image_url or url_for('static', filename='unknown.png')
 
+    def __ensure_details(self):
+        if self.fetched_at is None:
+            loader = metadata_loader()
+            loader.prime([self])
+            loader.load()
 
-class Artist(db.Model):
+    @classmethod
+    def load_details(cls, items, refresh=False):
+        spotify_ids = [item.spotify_id for item in items]
+        details = cls._fetch_details(spotify_ids, refresh=refresh)
+        fetched_at = datetime.utcnow()
+
+        rows = []
+        for item in items:
+            if item.spotify_id not in details:
+                continue
+
+            values = {
+                'spotify_name': details[item.spotify_id]['name'],
+                'spotify_url': details[item.spotify_id]['url'],
+                'image_url': details[item.spotify_id]['image'],
+                'fetched_at': fetched_at,
+            }
+            for key, value in values.items():
+                set_committed_value(item, key, value)
+            rows.append({'item_id': item.id, **values})
+
+        if not rows:
+            return
+
+        # Written on a separate connection, so that committing does not
+        # expire the objects the current request has already loaded.
+        table = cls.__table__
+        statement = table.update().where(table.c.id == bindparam('item_id'))
+        with db.engine.begin() as connection:
+            connection.execute(statement, rows)
+            index_names(connection.execute, table, {
+                row['item_id']: row['spotify_name'] for row in rows
+            })
+
+
+class Artist(SpotifyItemMixin, db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     spotify_id = db.Column(db.String(32), index=True, unique=True)
 
     @classmethod
-    def get(cls, spotify_id):
-        try:
-            db.session.add(cls(spotify_id=spotify_id))
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
+    def search(cls, artist_query):
+        config = current_app.config
+        if config['SEARCH_LOCAL']:
+            artists = cls.search_local(artist_query, config['SEARCH_LOCAL_RESULTS'])
+            if artists:
+                # Spotify may know more artists by that name. They are
+                # stored, and so found locally, from the next search on.
+                if not SpotifyHandler().hasArtistSearch(artist_query):
+                    in_background(cls.__merge_search, artist_query)
+                    # Until then the page is partial and must not be
+                    # cached publicly.
+                    metadata_loader().incomplete = True
+                return artists
 
-        return cls.query.filter(cls.spotify_id == spotify_id)[0]
+        try:
+            return cls.__search_spotify(artist_query)
+        except SPOTIFY_ERRORS:
+            # Names stored so far are better than no results, but the
+            # page should not be cached as complete.
+            artists = cls.search_local(artist_query, config['SEARCH_LOCAL_RESULTS'])
+            if not artists:
+                raise
+            metadata_loader().incomplete = True
+            return artists
 
     @classmethod
-    def search(cls, artist_query):
+    def __search_spotify(cls, artist_query):
         handler = SpotifyHandler()
         artist_ids = handler.searchArtistSpotifyIDs(artist_query)
-        artists = [Artist.get(artist_id) for artist_id in artist_ids]
+        artists = cls.get_many(artist_ids)
 
         return artists
 
-    def name(self):
-        return self.__details()['name']
+    @classmethod
+    def __merge_search(cls, artist_query):
+        artists = cls.__search_spotify(artist_query)
+        # Search results put the artists' details in the cache.
+        cls.load_details([artist for artist in artists if artist.fetched_at is None])
 
-    def spotifyURL(self):
-        return self.__details()['url']
+    @classmethod
+    def _fetch_details(cls, spotify_ids, refresh=False):
+        return SpotifyHandler().detailsForArtists(spotify_ids, refresh=refresh)
 
     def editURL(self):
         return url_for('edit_artist', artist_id=self.spotify_id)
 
-    def albums(self):
+    @staticmethod
+    def albums_of(spotify_id, album_groups='album'):
+        # Needs no stored artist, so that an ID Spotify does not know can
+        # be turned away before it is stored.
         handler = SpotifyHandler()
-        albums = handler.artistAlbums(self.spotify_id)
-        return albums
+        albums = Album.get_many(handler.artistAlbums(spotify_id, album_groups))
 
-    def image(self):
-        return self.__details()['image']
+        # Details are in the album cache by now, so this stores them
+        # without further calls.
+        loader = metadata_loader()
+        loader.prime(albums)
+        loader.load()
 
-    def __details(self):
-        return _get_artist_details(self.spotify_id)
+        return albums
+
+    def albumsURL(self):
+        return url_for('show_artist', artist_id=self.spotify_id)
 
     def render(self):
-        render_artist = get_template_attribute('_artist.html', 'render')
-        return render_artist(artist=self)
+        return render_item(self, '_artist.html')
 
-class Album(db.Model):
+class Album(SpotifyItemMixin, db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     spotify_id = db.Column(db.String(32), index=True, unique=True)
 
     @classmethod
-    def get(cls, spotify_id):
-        try:
-            db.session.add(cls(spotify_id=spotify_id))
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
+    def _fetch_details(cls, spotify_ids, refresh=False):
+        return SpotifyHandler().detailsForAlbums(spotify_ids, refresh=refresh)
 
-        return cls.query.filter(cls.spotify_id == spotify_id)[0]
+    def editURL(self):
+        return url_for('edit_album', album_id=self.spotify_id)
 
-    def name(self):
-        return self.__details()['name']
+    def render(self):
+        return render_item(self, '_album.html')
 
-    def spotifyURL(self):
-        return self.__details()['url']
 
-    def editURL(self):
-        return url_for('edit_album', album_id=self.spotify_id),
+# Names of artists and albums seen so far can be searched without Spotify.
+register_index(Artist.__table__)
+register_index(Album.__table__)
 
-    def image(self):
-        return self.__details()['image']
 
-    def __details(self):
-        return SpotifyHandler().detailsForAlbum(self.spotify_id)
+class Job(db.Model):
 
-    def render(self):
-        render_album = get_template_attribute('_album.html', 'render')
-        return render_album(album=self)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    kind = db.Column(db.String(32))
+    target = db.Column(db.String(64))
+    status = db.Column(db.String(16), index=True, default='queued')
+    attempts = db.Column(db.Integer, default=0)
+    items = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(256))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship('User')
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.target} {self.status}>'
+
+
+# Fields of a logged in user that are kept in the 'user' cache. The
+# others are loaded, in one query, when they are needed: the password
+# hash, and the tags version, which must be current for HTTP validators
+# even right after another process changed it.
+_IDENTITY_FIELDS = ('id', 'username', 'email')
 
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    with timed('load_user'):
+        users = get_cache('user')
+        fields = users.get(id)
+        if fields is None:
+            user = User.query.get(int(id))
+            if user is not None:
+                users.set(id, _identity(user))
+            return user
+
+        user = User(**fields)
+        # Attached to the session as if it had been queried.
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+
+def _identity(user):
+    return {name: getattr(user, name) for name in _IDENTITY_FIELDS}
+
+
+def _forget_after_commit(session, user_id):
+    # Dropped from the cache once the change is visible to other requests.
+    session.info.setdefault('forget_users', set()).add(str(user_id))
+
+
+@event.listens_for(User, 'after_update')
+def _forget_updated_user(mapper, connection, user):
+    _forget_after_commit(object_session(user), user.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _forget_users(session):
+    user_ids = session.info.pop('forget_users', None)
+    if user_ids:
+        get_cache('user').delete_many(user_ids)
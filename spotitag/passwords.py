@@ -0,0 +1,72 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from spotitag.instrumentation import timed
+
+
+class PasswordBusyError(RuntimeError):
+    pass
+
+
+def _gevent_patched():
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+
+class _Hasher:
+    # Hashing is slow on purpose. It runs on a few dedicated threads, and
+    # callers beyond those and a short queue are turned away instead of
+    # tying up more workers. The bound is per process, so it only sheds
+    # load where a process serves several requests at once, as gevent
+    # and threaded workers do. A sync worker serves one request at a time
+    # and never reaches it; there, a login burst still occupies every
+    # worker that receives one.
+
+    def __init__(self, workers, queue):
+        if _gevent_patched():
+            # Patched threads are greenlets, which would hash on the hub
+            # and stall every other request of the worker.
+            from gevent.threadpool import ThreadPoolExecutor as executor_class
+        else:
+            executor_class = ThreadPoolExecutor
+        self.__executor = executor_class(max_workers=workers)
+        self.__slots = threading.BoundedSemaphore(workers + queue)
+
+    def run(self, fn, *args):
+        if not self.__slots.acquire(blocking=False):
+            raise PasswordBusyError('Too many password checks in progress')
+        try:
+            return self.__executor.submit(fn, *args).result()
+        finally:
+            self.__slots.release()
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def _get_hasher():
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                config = current_app.config
+                _hasher = _Hasher(
+                    config['PASSWORD_HASH_WORKERS'], config['PASSWORD_HASH_QUEUE'])
+    return _hasher
+
+
+def hash_password(password):
+    with timed('password_hash'):
+        return _get_hasher().run(generate_password_hash, password)
+
+
+def check_password(password_hash, password):
+    with timed('password_check'):
+        return _get_hasher().run(check_password_hash, password_hash, password)
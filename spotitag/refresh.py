@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from spotitag import db
+from spotitag.models import Artist, Album
+
+
+def refresh_stale_metadata(max_age, batch_size=500):
+    cutoff = datetime.utcnow() - max_age
+    refreshed = 0
+
+    for model in (Artist, Album):
+        last_id = 0
+        while True:
+            items = model.query.filter(
+                or_(model.fetched_at.is_(None), model.fetched_at < cutoff),
+                model.id > last_id,
+            ).order_by(model.id).limit(batch_size).all()
+
+            if not items:
+                break
+
+            model.load_details(items, refresh=True)
+            refreshed += len(items)
+            last_id = items[-1].id
+
+            # Release the loaded batch before the next one.
+            db.session.expunge_all()
+
+    return refreshed
@@ -1,12 +1,23 @@
-from flask import render_template, url_for, redirect, flash, request
+import io
+import math
+
+from flask import render_template, url_for, redirect, flash, request, Response, stream_with_context, jsonify, make_response, abort
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.urls import url_parse
-from collections import defaultdict
+from sqlalchemy.exc import IntegrityError
+import spotipy
 
-from spotitag.forms import QueryForm, EditForm, LoginForm, RegistrationForm
+from spotitag.forms import QueryForm, EditForm, TagQueryForm, ImportForm, LoginForm, RegistrationForm
 from spotitag import app, db
-from spotitag.models import User, Album, Artist
-from spotitag.spotify import SpotifyHandler
+from spotitag.models import User, Album, Artist, Job
+from spotitag.spotify import SpotifyHandler, ALBUM_GROUPS, SPOTIFY_ERRORS, SPOTIFY_ID
+from spotitag.scheduler import RateLimited
+from spotitag.loader import metadata_loader
+from spotitag.tagquery import TagQueryError
+from spotitag import bulk, jobs
+from spotitag.httpcache import conditional_on_tags, cache_publicly
+from spotitag.instrumentation import timed
+from spotitag.passwords import PasswordBusyError
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -24,8 +35,13 @@ def login():
         return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
+        with timed('user_lookup'):
+            user = User.query.filter_by(username=form.username.data).first()
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except PasswordBusyError:
+            return _busy('login.html', title='Sign In', form=form)
+        if not valid:
             flash('Invalid username or password')
             return redirect(url_for('login'))
         login_user(user, remember=form.remember_me.data)
@@ -49,18 +65,53 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordBusyError:
+            return _busy('register.html', title='Register', form=form)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Taken since the form was validated.
+            db.session.rollback()
+            form.validate_available()
+            return render_template('register.html', title='Register', form=form)
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('login'))
     return render_template('register.html', title='Register', form=form)
 
 
+def _busy(template_name, **context):
+    flash('Too many people are signing in right now, please try again in a moment.')
+    response = make_response(render_template(template_name, **context), 503)
+    response.headers['Retry-After'] = '5'
+    return response
+
+
+def spotify_unavailable(error):
+    response = make_response(render_template(
+        'error.html', title='Spotify is unavailable',
+        message='Spotify could not be reached, please try again in a moment.'), 503)
+    if isinstance(error, RateLimited):
+        response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+for error_class in SPOTIFY_ERRORS:
+    app.register_error_handler(error_class, spotify_unavailable)
+
+
 @app.route('/result/<artist>')
+@cache_publicly
 def search_result(artist):
 
     artists = Artist.search(artist)
+
+    loader = metadata_loader()
+    loader.prime(artists)
+    loader.load()
+
     return render_template(
         'result.html',
         title=f'Search results for artist {artist}',
@@ -68,30 +119,244 @@ def search_result(artist):
     )
 
 
+@app.route('/artist/<artist_id>')
+def show_artist(artist_id):
+    album_groups = ','.join(
+        group for group in request.args.get('groups', '').split(',')
+        if group in ALBUM_GROUPS.split(',')
+    ) or 'album'
+    if not SPOTIFY_ID.fullmatch(artist_id):
+        abort(404)
+    try:
+        albums = Artist.albums_of(artist_id, album_groups)
+    except spotipy.SpotifyException as error:
+        if error.http_status not in (400, 404):
+            raise
+        abort(404)
+    artist = Artist.get(artist_id)
+
+    return render_template(
+        'artist.html', title=artist.name(), artist=artist, albums=albums,
+        album_groups=album_groups)
+
+
 @app.route('/tags')
 @login_required
+@conditional_on_tags
 def show_tags():
-    tags = defaultdict(lambda: defaultdict(list))
+    after = request.args.get('after', 0, type=int)
+    stream = request.args.get('stream', int(app.config['TAGS_STREAM']), type=int)
+
+    tags, has_next = current_user.tags_page(
+        after=after, limit=app.config['TAGS_PER_PAGE'])
+    next_url = None
+    if has_next:
+        next_url = url_for('show_tags', after=tags[-1].id, stream=stream or None)
+
+    recent = []
+    if not after:
+        recent = current_user.recently_tagged(limit=app.config['RECENTLY_TAGGED'])
+        # Loaded together with the first batch of tagged items.
+        metadata_loader().prime(item for item, _ in recent)
+
+    if stream:
+        return _stream_template(
+            'tags.html', sections=_tag_sections(tags), next_url=next_url,
+            recent=recent)
+
+    sections = list(_tag_sections(tags, prefetch=True))
+    return render_template(
+        'tags.html', sections=sections, next_url=next_url, recent=recent)
+
+
+def _tag_sections(tags, prefetch=False):
+    artists = current_user.artists_by_tag(tags)
+    albums = current_user.albums_by_tag(tags)
+    loader = metadata_loader()
+
+    if prefetch:
+        for tag in tags:
+            loader.prime(artists.get(tag, []))
+            loader.prime(albums.get(tag, []))
+        loader.load()
+
+    for tag in tags:
+        tagged = {
+            'artists': artists.get(tag, []),
+            'albums': albums.get(tag, []),
+        }
+        # Nothing is left to load here when the page was prefetched.
+        loader.prime(tagged['artists'])
+        loader.prime(tagged['albums'])
+        loader.load()
+
+        yield tag, tagged
+
+
+def _stream_template(template_name, **context):
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.generate(context)))
+
+
+@app.route('/query')
+@login_required
+@conditional_on_tags
+def query_tags():
+    form = TagQueryForm(request.args, meta={'csrf': False})
+    items, next_url = [], None
+
+    if request.args and form.validate():
+        try:
+            items, next_url = _query_items(form.q.data, form.kind.data, 'query_tags')
+        except TagQueryError as error:
+            form.q.errors.append(str(error))
+
+    return render_template(
+        'query.html', title='Query tags', form=form, items=items, next_url=next_url)
+
+
+@app.route('/api/query')
+@login_required
+@conditional_on_tags
+def api_query_tags():
+    expression = request.args.get('q', '')
+    kind = request.args.get('kind', 'artists')
+    if kind not in ('artists', 'albums'):
+        return jsonify(error=f'Unknown kind {kind!r}'), 400
 
-    for tag, artists in current_user.artists_by_tag().items():
-        for artist in artists:
-            tags[tag]['artists'].append(artist)
+    try:
+        items, next_url = _query_items(expression, kind, 'api_query_tags')
+    except TagQueryError as error:
+        return jsonify(error=str(error)), 400
 
-    for tag, albums in current_user.albums_by_tag().items():
-        for album in albums:
-            tags[tag]['albums'].append(album)
+    return jsonify(
+        query=expression,
+        kind=kind,
+        items=[
+            {
+                'spotify_id': item.spotify_id,
+                'name': item.name(),
+                'url': item.spotifyURL(),
+                'image': item.image(),
+            }
+            for item in items
+        ],
+        next=next_url,
+    )
+
+
+@app.route('/api/tags/complete')
+@login_required
+def complete_tags():
+    prefix = request.args.get('q', '')
+    limit = min(
+        request.args.get('limit', app.config['AUTOCOMPLETE_RESULTS'], type=int), 50)
+
+    return jsonify(
+        query=prefix,
+        tags=[
+            {'label': label, 'count': count}
+            for label, count in current_user.complete_tags(prefix, limit)
+        ],
+    )
+
+
+def _query_items(expression, kind, endpoint):
+    after = request.args.get('after', 0, type=int)
+    matching = current_user.artists_matching if kind == 'artists' \
+        else current_user.albums_matching
+    items, has_next = matching(
+        expression, after=after, limit=app.config['QUERY_RESULTS_PER_PAGE'])
+
+    loader = metadata_loader()
+    loader.prime(items)
+    loader.load()
 
+    next_url = None
+    if has_next:
+        next_url = url_for(endpoint, q=expression, kind=kind, after=items[-1].id)
+    return items, next_url
 
-    return render_template('tags.html', tags=tags)
+
+@app.route('/candidates', methods=['GET', 'POST'])
+@login_required
+def candidates():
+    form = ImportForm()
+    if form.validate_on_submit():
+        try:
+            jobs.enqueue(current_user, form.kind.data, form.target.data)
+        except jobs.JobError as error:
+            form.target.errors.append(str(error))
+        else:
+            return redirect(url_for('candidates'))
+
+    kind = request.args.get('kind', 'albums')
+    after = request.args.get('after', 0, type=int)
+    page = current_user.artist_candidates_page if kind == 'artists' \
+        else current_user.album_candidates_page
+    items, has_next = page(after=after, limit=app.config['CANDIDATES_PER_PAGE'])
+
+    # Imported albums usually arrive with their details already stored.
+    loader = metadata_loader()
+    loader.prime(items)
+    loader.load()
+
+    next_url = None
+    if has_next:
+        next_url = url_for('candidates', kind=kind, after=items[-1].id)
+
+    recent_jobs = Job.query.filter_by(user_id=current_user.id) \
+        .order_by(Job.id.desc()).limit(10).all()
+
+    return render_template(
+        'candidates.html', title='Imported items', form=form, kind=kind,
+        items=items, next_url=next_url, jobs=recent_jobs)
+
+
+@app.route('/export')
+@login_required
+def export_tags():
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in bulk.FORMATS:
+        return jsonify(error=f'Unknown format {fmt!r}'), 400
+
+    records = bulk.export_records(current_user, batch_size=app.config['BULK_BATCH_SIZE'])
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(bulk.write_records(records, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=spotitag-tags.{fmt}'},
+    )
+
+
+@app.route('/import', methods=['POST'])
+@login_required
+def import_tags():
+    # Either a multipart upload or the raw file as the request body, with
+    # the CSRF token of any page in a csrf_token field or an X-CSRFToken
+    # header.
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format', bulk.format_for(upload and upload.filename))
+    lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    try:
+        stats = bulk.import_records(
+            current_user,
+            bulk.read_records(lines, fmt),
+            batch_size=app.config['BULK_BATCH_SIZE'],
+            replace=request.args.get('replace', 0, type=int) == 1,
+        )
+    except bulk.BulkFormatError as error:
+        return jsonify(error=str(error)), 400
+
+    return jsonify(stats.as_dict())
 
 
 @app.route('/editartist/<artist_id>', methods=['GET', 'POST'])
 @login_required
 def edit_artist(artist_id):
-    artist = Artist.get(artist_id)
-    
-    tags = current_user.tags_by_artist()[artist]
-
     form = EditForm()
     if form.validate_on_submit():
         new_tags = [
@@ -103,7 +368,8 @@ def edit_artist(artist_id):
 
         return redirect(url_for('show_tags'))
 
-    form.new_tags.data = ';'.join(tag.label for tag in tags)
+    artist = Artist.get(artist_id)
+    form.new_tags.data = ';'.join(current_user.artist_tag_labels(artist))
 
     return render_template('edit.html', form=form, item=artist)
 
@@ -111,10 +377,6 @@ def edit_artist(artist_id):
 @app.route('/editalbum/<album_id>', methods=['GET', 'POST'])
 @login_required
 def edit_album(album_id):
-    album = Album.get(album_id)
-
-    tags = current_user.tags_by_album()[album]
-
     form = EditForm()
     if form.validate_on_submit():
         new_tags = [
@@ -126,6 +388,7 @@ def edit_album(album_id):
 
         return redirect(url_for('show_tags'))
 
-    form.new_tags.data = ';'.join(tag.label for tag in tags)
+    album = Album.get(album_id)
+    form.new_tags.data = ';'.join(current_user.album_tag_labels(album))
 
     return render_template('edit.html', form=form, item=album)
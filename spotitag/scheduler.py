@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, wait
+
+import spotipy
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__updated = time.monotonic()
+        self.__paused_until = 0
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        waited = 0
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                if now >= self.__paused_until:
+                    elapsed = now - max(self.__updated, self.__paused_until)
+                    self.__tokens = min(
+                        self.capacity, self.__tokens + elapsed * self.rate)
+                    self.__updated = now
+
+                    if self.__tokens >= 1:
+                        self.__tokens -= 1
+                        return waited
+                    delay = (1 - self.__tokens) / self.rate
+                else:
+                    delay = self.__paused_until - now
+
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        with self.__lock:
+            self.__paused_until = max(
+                self.__paused_until, time.monotonic() + seconds)
+            self.__tokens = 0
+
+
+class RateLimited(Exception):
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited by Spotify, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class Scheduler:
+
+    def __init__(self, rate, burst, max_retries=3, max_retry_after=10,
+                 backoff=0.5):
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.backoff = backoff
+        self.__bucket = TokenBucket(rate, burst)
+        self.__flights = {}
+        self.__lock = threading.Lock()
+        self.__stats = {
+            'requests': 0,
+            'throttled_seconds': 0.0,
+            'rate_limited': 0,
+            'retries': 0,
+            'coalesced': 0,
+        }
+
+    def request(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            waited = self.__bucket.acquire()
+            self.__count('requests')
+            self.__count('throttled_seconds', waited)
+
+            try:
+                return fn(*args, **kwargs)
+            except spotipy.SpotifyException as error:
+                if error.http_status != 429:
+                    raise
+                self.__count('rate_limited')
+
+                delay = _retry_after(error)
+                if delay is None:
+                    delay = self.backoff * 2 ** attempt
+                # Every caller in this worker waits, not just this one, and
+                # also when this one gives up.
+                self.__bucket.pause(delay)
+                if attempt == self.max_retries or delay > self.max_retry_after:
+                    raise RateLimited(delay) from error
+
+                self.__count('retries')
+
+    def single_flight(self, key, fn):
+        with self.__lock:
+            future = self.__flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.__flights[key] = future
+
+        if not leader:
+            self.__count('coalesced')
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats)
+
+    def __count(self, name, amount=1):
+        with self.__lock:
+            self.__stats[name] += amount
+
+
+class BatchLoader:
+
+    def __init__(self, fetch, window):
+        self.__fetch = fetch
+        self.__window = window
+        self.__in_flight = {}
+        self.__queued = []
+        self.__lock = threading.Lock()
+
+    def load_many(self, keys, timeout):
+        futures = {}
+        leader = False
+
+        with self.__lock:
+            for key in keys:
+                future = self.__in_flight.get(key)
+                if future is None:
+                    future = Future()
+                    self.__in_flight[key] = future
+                    leader = leader or not self.__queued
+                    self.__queued.append(key)
+                futures[key] = future
+
+        # The caller that opened the batch collects keys queued by other
+        # requests during the window and fetches them all at once.
+        if leader:
+            self.__flush()
+
+        done, _ = wait(futures.values(), timeout=timeout)
+        return {
+            key: future.result()
+            for key, future in futures.items()
+            if future in done and future.exception() is None
+            and future.result() is not None
+        }
+
+    def __flush(self):
+        batch, results, failure = None, {}, None
+        try:
+            if self.__window:
+                time.sleep(self.__window)
+
+            with self.__lock:
+                batch, self.__queued = self.__queued, []
+
+            results = self.__fetch(batch)
+        except Exception as error:
+            logger.warning('Batch of %d lookups failed: %s', len(batch or ()), error)
+        except BaseException as error:
+            # Such as gevent.Timeout; the waiters fail along with this
+            # caller instead of waiting out their timeouts.
+            failure = error
+            raise
+        finally:
+            # Every queued key is resolved, or none would ever be again.
+            with self.__lock:
+                if batch is None:
+                    batch, self.__queued = self.__queued, []
+                for key in batch:
+                    future = self.__in_flight.pop(key)
+                    if failure is not None:
+                        future.set_exception(failure)
+                    else:
+                        future.set_result(results.get(key))
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,160 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import DDL, event, func, select, text
+
+from spotitag import db
+from spotitag.spotify import _PerProcess
+
+
+logger = logging.getLogger(__name__)
+
+# Only the words of a query are searched for, which keeps FTS5 query
+# syntax out of user input.
+_WORD = re.compile(r'\w+')
+
+# Most matches ranked for one query.
+_CANDIDATES = 200
+
+# SQLite keeps names in an FTS5 table per item table, with the item ID as
+# rowid, and indexes short prefixes too, since queries are searched as
+# they are typed. PostgreSQL searches the item table through a trigram
+# index, which it maintains itself.
+_FTS_TABLE = "CREATE VIRTUAL TABLE {table}_search USING fts5(" \
+    "name, tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+_TRIGRAM_INDEX = 'CREATE INDEX ix_{table}_spotify_name_trgm' \
+    ' ON {table} USING gin (spotify_name gin_trgm_ops)'
+
+
+# Names of the tables register_index was called for.
+_indexed_tables = set()
+
+
+def register_index(table):
+    # Creates the index along with the table, for db.create_all(); the
+    # migrations create it for existing databases.
+    _indexed_tables.add(table.name)
+    event.listen(table, 'after_create', DDL(
+        _FTS_TABLE.format(table=table.name)).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL(
+        f'DROP TABLE IF EXISTS {table.name}_search').execute_if(dialect='sqlite'))
+
+    event.listen(table, 'after_create', DDL(
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+    event.listen(table, 'after_create', DDL(
+        _TRIGRAM_INDEX.format(table=table.name)).execute_if(dialect='postgresql'))
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # For Alembic autogenerate, which would otherwise drop the index: the
+    # FTS5 table and its shadow tables, and the trigram index, are not in
+    # the metadata.
+    for table in _indexed_tables:
+        if type_ == 'table' and (name == f'{table}_search'
+                                 or name.startswith(f'{table}_search_')):
+            return False
+        if type_ == 'index' and name == f'ix_{table}_spotify_name_trgm':
+            return False
+    return True
+
+
+def index_names(execute, table, names):
+    # Replaces the indexed names of the given {item ID: name} in bulk,
+    # with execute being Session.execute or Connection.execute.
+    if db.engine.dialect.name != 'sqlite' or not names:
+        return
+
+    execute(
+        text(f'DELETE FROM {table.name}_search WHERE rowid = :item_id'),
+        [{'item_id': item_id} for item_id in names],
+    )
+    rows = [
+        {'item_id': item_id, 'name': name}
+        for item_id, name in names.items() if name
+    ]
+    if rows:
+        execute(
+            text(f'INSERT INTO {table.name}_search (rowid, name)'
+                 f' VALUES (:item_id, :name)'),
+            rows,
+        )
+
+
+def rebuild_index(table):
+    # Indexes every named item from scratch, with a single INSERT.
+    if db.engine.dialect.name != 'sqlite':
+        return
+
+    db.session.execute(text(f'DELETE FROM {table.name}_search'))
+    db.session.execute(text(
+        f'INSERT INTO {table.name}_search (rowid, name)'
+        f' SELECT id, spotify_name FROM {table.name}'
+        f' WHERE spotify_name IS NOT NULL'
+    ))
+
+
+def search_names(table, query, limit):
+    # Returns the IDs of items whose names contain every word of the
+    # query, best match first, or None when the database has no index.
+    words = _WORD.findall(query)
+    dialect = db.engine.dialect.name
+
+    if dialect == 'sqlite':
+        if not words:
+            return []
+        # Every word also matches as the start of a longer one.
+        match = ' '.join(f'"{word}"*' for word in words)
+        # Ranking costs far more than matching, so a short prefix that
+        # matches much of the index only has its first candidates ranked.
+        return [
+            item_id for item_id, in db.session.execute(
+                text(f'SELECT rowid FROM ('
+                     f' SELECT rowid, rank FROM {table.name}_search'
+                     f' WHERE {table.name}_search MATCH :match LIMIT :candidates)'
+                     f' ORDER BY rank LIMIT :limit'),
+                {'match': match, 'candidates': _CANDIDATES, 'limit': limit},
+            )
+        ]
+
+    if dialect == 'postgresql':
+        if not words:
+            return []
+        name = table.c.spotify_name
+        return [
+            item_id for item_id, in db.session.execute(
+                select(table.c.id)
+                .where(*(name.ilike('%' + word.replace('_', '\\_') + '%')
+                         for word in words))
+                .order_by(func.similarity(name, query).desc())
+                .limit(limit)
+            )
+        ]
+
+    return None
+
+
+def _build_executor():
+    return ThreadPoolExecutor(
+        max_workers=current_app.config['SEARCH_MERGE_WORKERS'],
+        thread_name_prefix='search',
+    )
+
+
+_executor = _PerProcess(_build_executor)
+
+
+def in_background(fn, *args):
+    # Runs fn(*args) in an app context after the current request has
+    # moved on. Failures are only logged.
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception('Background search failed')
+
+    return _executor.get().submit(run)
@@ -1,44 +1,289 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
 import spotipy
+from requests.adapters import HTTPAdapter
 from spotipy.oauth2 import SpotifyClientCredentials
-from cacheout.memoization import memoize
-from cacheout.fifo import FIFOCache
-from flask import url_for
+from flask import current_app
 
+from spotitag.cache import get_cache
+from spotitag.instrumentation import record_spotify_call
+from spotitag.scheduler import Scheduler, BatchLoader, RateLimited
 
-def _fetch_details_albums(spotify_ids):
-    if len(spotify_ids) == 0:
-        return {}
-    
-    spotify_client = SpotifyHandler().client()
-    results = spotify_client.albums(spotify_ids)
-
-    details = {
-        spotify_id: {
-            'id': result['id'],
-            'name': result['name'],
-            'url': result['external_urls']['spotify'],
-            'edit': url_for('edit_album', album_id=spotify_id),
-            'image': _smallest_image(result['images']),
+
+logger = logging.getLogger(__name__)
+
+ARTIST_BATCH_SIZE = 50
+ALBUM_BATCH_SIZE = 20
+PAGE_SIZE = 50
+PLAYLIST_PAGE_SIZE = 100
+ALBUM_GROUPS = 'album,single,compilation,appears_on'
+PLAYLIST_FIELDS = (
+    'items(track(id,artists(id),album(id,name,external_urls,images))),next'
+)
+# Spotify IDs are 22 base62 characters.
+SPOTIFY_ID = re.compile(r'[A-Za-z0-9]{22}')
+
+# Raised by calls that reach Spotify, when it cannot answer right now.
+SPOTIFY_ERRORS = (spotipy.SpotifyException, requests.RequestException, RateLimited)
+
+
+class _PerProcess:
+    # Objects holding sockets, threads or locks must not be shared with
+    # gunicorn workers forked after they were created.
+
+    def __init__(self, factory):
+        self.__factory = factory
+        self.__value = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+
+    def get(self):
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__value = self.__factory()
+                    self.__pid = os.getpid()
+        return self.__value
+
+    def peek(self):
+        if self.__pid != os.getpid():
+            return None
+        return self.__value
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _details(result):
+    return {
+        'id': result['id'],
+        'name': result['name'],
+        'url': result['external_urls']['spotify'],
+        'image': _smallest_image(result['images']),
+    }
+
+
+def _fetch_details(fetch_batch, key, spotify_ids, batch_size):
+    scheduler = _scheduler.get()
+
+    def fetch(chunk):
+        results = scheduler.request(fetch_batch, chunk)[key]
+        return {
+            spotify_id: _details(result)
+            for spotify_id, result in zip(chunk, results)
+            if result is not None
         }
-        for spotify_id, result in zip(spotify_ids, results['albums'])
+
+    return _fan_out(fetch, _chunks(spotify_ids, batch_size))
+
+
+def _fetch_details_albums(spotify_ids):
+    return _batch_loaders.get()['albums'].load_many(
+        spotify_ids, timeout=_batch_timeout())
+
+
+def _fetch_details_artists(spotify_ids):
+    return _batch_loaders.get()['artists'].load_many(
+        spotify_ids, timeout=_batch_timeout())
+
+
+def _batch_timeout():
+    config = current_app.config
+    return config['SPOTIFY_BATCH_WINDOW'] + config['SPOTIFY_FANOUT_TIMEOUT']
+
+
+def _build_scheduler():
+    config = current_app.config
+    return Scheduler(
+        rate=config['SPOTIFY_RATE_LIMIT'],
+        burst=config['SPOTIFY_RATE_BURST'],
+        max_retries=config['SPOTIFY_MAX_RETRIES'],
+        max_retry_after=config['SPOTIFY_MAX_RETRY_AFTER'],
+    )
+
+
+def _build_batch_loaders():
+    # Single lookups from concurrent requests that arrive within the batch
+    # window are merged into multi-ID calls; IDs already being fetched are
+    # shared rather than requested twice.
+    spotify_client = _shared_client.get()
+    window = current_app.config['SPOTIFY_BATCH_WINDOW']
+
+    def fetch_artists(spotify_ids):
+        return _fetch_details(
+            spotify_client.artists, 'artists', spotify_ids, ARTIST_BATCH_SIZE)
+
+    def fetch_albums(spotify_ids):
+        return _fetch_details(
+            spotify_client.albums, 'albums', spotify_ids, ALBUM_BATCH_SIZE)
+
+    return {
+        'artists': BatchLoader(fetch_artists, window),
+        'albums': BatchLoader(fetch_albums, window),
     }
 
-    return details
 
+_scheduler = _PerProcess(_build_scheduler)
+_batch_loaders = _PerProcess(_build_batch_loaders)
 
-class SpotifyHandler:
 
-    __album_cache = FIFOCache(maxsize=512, ttl=3600)
+def _build_executor():
+    return ThreadPoolExecutor(
+        max_workers=current_app.config['SPOTIFY_FANOUT_WORKERS'],
+        thread_name_prefix='spotify',
+    )
+
+
+_executor = _PerProcess(_build_executor)
+
+
+def _fan_out(fetch, batches):
+    # Runs fetch(batch) for every batch on the shared pool, with at most
+    # SPOTIFY_FANOUT_LIMIT batches of this request in flight. Batches that
+    # fail or miss the deadline are left out of the result, so callers
+    # can fall back to placeholders.
+    limit = current_app.config['SPOTIFY_FANOUT_LIMIT']
+    deadline = time.monotonic() + current_app.config['SPOTIFY_FANOUT_TIMEOUT']
+    executor = _executor.get()
+
+    pending = list(batches)
+    running = {}
+    results = {}
+
+    while pending or running:
+        while pending and len(running) < limit:
+            batch = pending.pop(0)
+            # Copying the context keeps the lookups attributed to this
+            # request's metrics.
+            context = contextvars.copy_context()
+            running[executor.submit(context.run, fetch, batch)] = batch
+
+        done, _ = wait(
+            running,
+            timeout=max(deadline - time.monotonic(), 0),
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            logger.warning(
+                'Spotify lookups timed out for %d batches',
+                len(running) + len(pending))
+            break
+
+        for future in done:
+            batch = running.pop(future)
+            try:
+                results.update(future.result())
+            except SPOTIFY_ERRORS as error:
+                logger.warning(
+                    'Spotify lookup failed for %d ids: %s', len(batch), error)
+
+    for future in running:
+        future.cancel()
+
+    return results
+
+
+class _CountingClientCredentials(SpotifyClientCredentials):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.token_fetches = 0
+        self.__lock = threading.Lock()
+
+    def get_access_token(self, as_dict=True):
+        # spotipy keeps the token in memory and refreshes it 60 seconds
+        # before it expires; the lock keeps concurrent callers from all
+        # requesting a new one at the same time.
+        with self.__lock:
+            return super().get_access_token(as_dict=as_dict)
+
+    def _request_access_token(self):
+        self.token_fetches += 1
+        return super()._request_access_token()
 
-    def detailsForAlbums(self, spotify_ids):
 
-        album_details = self.__album_cache.get_many(spotify_ids)
+class _InstrumentedSpotify(spotipy.Spotify):
+
+    def _internal_call(self, method, url, payload, params):
+        start = time.perf_counter()
+        try:
+            return super()._internal_call(method, url, payload, params)
+        finally:
+            record_spotify_call(url, self.prefix, time.perf_counter() - start)
+
+
+def _build_client():
+    pool_size = current_app.config['SPOTIFY_POOL_SIZE']
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    credentials = _CountingClientCredentials(requests_session=session)
+    credentials.OAUTH_TOKEN_URL = current_app.config['SPOTIFY_TOKEN_URL']
+
+    spotify_client = _InstrumentedSpotify(
+        client_credentials_manager=credentials,
+        requests_session=session,
+        requests_timeout=current_app.config['SPOTIFY_TIMEOUT'],
+    )
+    spotify_client.prefix = current_app.config['SPOTIFY_API_URL']
+    return spotify_client
+
+
+_shared_client = _PerProcess(_build_client)
+
+
+def _client_stats():
+    stats = {
+        'token_fetches': 0,
+        'http_requests': 0,
+        'http_connections': 0,
+        'http_connections_reused': 0,
+    }
+    spotify_client = _shared_client.peek()
+    if spotify_client is None:
+        return stats
+
+    stats['token_fetches'] = spotify_client.auth_manager.token_fetches
+
+    adapters = set(spotify_client._session.adapters.values())
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats['http_requests'] += pool.num_requests
+            stats['http_connections'] += pool.num_connections
+
+    stats['http_connections_reused'] = (
+        stats['http_requests'] - stats['http_connections'])
+
+    return stats
+
+
+class SpotifyHandler:
+
+    def detailsForAlbums(self, spotify_ids, refresh=False):
+        album_cache = get_cache('album')
+
+        album_details = {} if refresh else album_cache.get_many(spotify_ids)
        
         albums_to_fetch = set(spotify_ids) - set(album_details.keys())
         fetched_details = _fetch_details_albums(albums_to_fetch)
 
         album_details.update(fetched_details)
-        self.__album_cache.set_many(fetched_details)
+        album_cache.set_many(fetched_details)
        
         return album_details
 
@@ -46,40 +291,146 @@ class SpotifyHandler:
         details = self.detailsForAlbums([spotify_id])
         return details[spotify_id]
 
+    def detailsForArtists(self, spotify_ids, refresh=False):
+        artist_cache = get_cache('artist')
+
+        artist_details = {} if refresh else artist_cache.get_many(spotify_ids)
+
+        artists_to_fetch = set(spotify_ids) - set(artist_details.keys())
+        fetched_details = _fetch_details_artists(artists_to_fetch)
+
+        artist_details.update(fetched_details)
+        artist_cache.set_many(fetched_details)
+
+        return artist_details
+
     def client(self):
-        return spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
+        return _shared_client.get()
+
+    def clientStats(self):
+        return _client_stats()
+
+    def schedulerStats(self):
+        return _scheduler.get().stats()
 
     def searchArtistSpotifyIDs(self, artist_query):
-        search = self.client().search(q=f'artist:{artist_query}', type='artist')
-        artist_spotify_ids = [item['id'] for item in search['artists']['items']]
+        query = _normalize_query(artist_query)
+        search_cache = get_cache('search')
+
+        artist_spotify_ids = search_cache.get(query)
+        if artist_spotify_ids is not None:
+            _count_search('hits')
+            return artist_spotify_ids
+        _count_search('misses')
+
+        scheduler = _scheduler.get()
+        search = scheduler.single_flight(
+            ('search', query),
+            lambda: scheduler.request(
+                self.client().search, q=f'artist:{query}', type='artist'),
+        )
+        items = search['artists']['items']
+        artist_spotify_ids = [item['id'] for item in items]
+
+        # Search results carry full artist objects, which saves a lookup
+        # per result when they are rendered.
+        get_cache('artist').set_many({item['id']: _details(item) for item in items})
+
+        ttl = None
+        if not artist_spotify_ids:
+            ttl = current_app.config['CACHE_SEARCH_EMPTY_TTL']
+        search_cache.set(query, artist_spotify_ids, ttl=ttl)
 
         return artist_spotify_ids
 
-    def artistAlbums(self, spotify_id):
-        album_result = self.client().artist_albums(spotify_id, album_type='album')
-        albums = [album['id'] for album in album_result['items']]
-        return albums
+    def hasArtistSearch(self, artist_query):
+        # Whether a search would be answered from the cache.
+        return get_cache('search').get(_normalize_query(artist_query)) is not None
 
+    def searchCacheStats(self):
+        with _search_stats_lock:
+            return dict(_search_stats)
 
-def _smallest_image(images):
-    if len(images) == 0:
-        return url_for('static', filename='unknown.png')
+    def artistAlbums(self, spotify_id, album_groups='album'):
+        album_list_cache = get_cache('artist_albums')
+        key = f'{spotify_id}:{album_groups}'
 
-    return min(images, key=lambda r: r['width'])['url']
+        album_ids = album_list_cache.get(key)
+        if album_ids is None:
+            album_ids = _scheduler.get().single_flight(
+                ('artist_albums', key),
+                lambda: list(dict.fromkeys(
+                    album['id']
+                    for page in self.artistAlbumPages(spotify_id, album_groups)
+                    for album in page
+                )),
+            )
+            album_list_cache.set(key, album_ids)
 
+        # The pages above already seeded the album cache; on a list hit
+        # this refetches, in batches, only details that expired since.
+        self.detailsForAlbums(album_ids)
+        return album_ids
 
-@memoize(maxsize=512, ttl=3600)
-def _get_artist_details(spotify_id):
-    spotify_handler = SpotifyHandler()
-    spotify_client = spotify_handler.client()
-    result = spotify_client.artist(spotify_id)
+    def artistAlbumPages(self, spotify_id, album_groups=ALBUM_GROUPS):
+        # Every page carries album names and images, so the album cache is
+        # seeded on the way and rendering them later needs no lookups.
+        client = self.client()
+        pages = _pages(
+            client, client.artist_albums,
+            spotify_id, album_type=album_groups, limit=PAGE_SIZE)
+        for page in pages:
+            albums = [_details(item) for item in page['items']]
+            get_cache('album').set_many({album['id']: album for album in albums})
+            yield albums
+
+    def playlistPages(self, spotify_id):
+        client = self.client()
+        pages = _pages(
+            client, client.playlist_items,
+            spotify_id, fields=PLAYLIST_FIELDS, limit=PLAYLIST_PAGE_SIZE,
+            additional_types=('track',))
+        for page in pages:
+            # Local files and removed tracks come without IDs.
+            tracks = [
+                item['track'] for item in page['items']
+                if item.get('track') and item['track'].get('id')
+            ]
+            albums = [
+                _details(track['album']) for track in tracks
+                if track['album'].get('id')
+            ]
+            get_cache('album').set_many({album['id']: album for album in albums})
+            artist_ids = [
+                artist['id'] for track in tracks
+                for artist in track['artists'] if artist.get('id')
+            ]
+            yield albums, list(dict.fromkeys(artist_ids))
 
-    artist_details = {
-        'id': spotify_id,
-        'url': result['external_urls']['spotify'],
-        'name': result['name'],
-        'edit': url_for('edit_artist', artist_id=spotify_id),
-        'image': _smallest_image(result['images']),
-    }
 
-    return artist_details
+def _pages(client, fetch, *args, **kwargs):
+    scheduler = _scheduler.get()
+    page = scheduler.request(fetch, *args, **kwargs)
+    while page is not None:
+        yield page
+        page = scheduler.request(client.next, page) if page['next'] else None
+
+
+_search_stats = {'hits': 0, 'misses': 0}
+_search_stats_lock = threading.Lock()
+
+
+def _count_search(outcome):
+    with _search_stats_lock:
+        _search_stats[outcome] += 1
+
+
+def _normalize_query(query):
+    return ' '.join(query.split()).casefold()
+
+
+def _smallest_image(images):
+    if len(images) == 0:
+        return None
+
+    return min(images, key=lambda r: r['width'])['url']
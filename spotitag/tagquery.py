@@ -0,0 +1,205 @@
+import re
+
+from sqlalchemy import select, union, intersect, except_
+
+
+class TagQueryError(ValueError):
+    pass
+
+
+# Labels are bare words (several words in a row form one label) or quoted.
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|(,)|"([^"]*)"|([^\s(),"]+))')
+_KEYWORDS = {'AND', 'OR', 'NOT'}
+
+
+class Label:
+
+    def __init__(self, label):
+        self.label = label
+
+    def __repr__(self):
+        return repr(self.label)
+
+
+class Not:
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __repr__(self):
+        return f'NOT {self.operand!r}'
+
+
+class And:
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def __repr__(self):
+        return '(' + ' AND '.join(map(repr, self.operands)) + ')'
+
+
+class Or:
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def __repr__(self):
+        return '(' + ' OR '.join(map(repr, self.operands)) + ')'
+
+
+def _tokenize(expression):
+    tokens = []
+    words = []
+
+    def end_label():
+        if words:
+            tokens.append(('label', ' '.join(words)))
+            words.clear()
+
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None:
+            raise TagQueryError(f'Unexpected {expression[position:]!r}')
+        position = match.end()
+        opening, closing, comma, quoted, word = match.groups()
+
+        if word is not None and word.upper() not in _KEYWORDS:
+            words.append(word)
+            continue
+
+        end_label()
+        if opening:
+            tokens.append(('(', opening))
+        elif closing:
+            tokens.append((')', closing))
+        elif comma:
+            # "a, b" reads as "any of a, b".
+            tokens.append(('OR', comma))
+        elif quoted is not None:
+            tokens.append(('label', quoted))
+        else:
+            tokens.append((word.upper(), word))
+
+    end_label()
+    return tokens
+
+
+class _Parser:
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise TagQueryError('Empty tag query')
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise TagQueryError(f'Unexpected {self.tokens[self.position][1]!r}')
+        return node
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            expected = 'a tag' if kind == 'label' else repr(kind)
+            found = repr(self.tokens[self.position][1]) if self.peek() else 'the end'
+            raise TagQueryError(f'Expected {expected} but found {found}')
+        self.position += 1
+        return self.tokens[self.position - 1][1]
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take('OR')
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() == 'AND':
+            self.take('AND')
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def parse_not(self):
+        if self.peek() == 'NOT':
+            self.take('NOT')
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        if self.peek() == '(':
+            self.take('(')
+            node = self.parse_or()
+            self.take(')')
+            return node
+        return Label(self.take('label'))
+
+
+def parse(expression):
+    return _Parser(_tokenize(expression)).parse()
+
+
+class _Compiler:
+
+    def __init__(self, association, item_id, tag_table, user_id, normalize):
+        self.association = association
+        self.item_id = item_id
+        self.tag_table = tag_table
+        self.user_id = user_id
+        self.normalize = normalize
+
+    def compile(self, node):
+        if isinstance(node, Label):
+            return self.tagged(node.label)
+        if isinstance(node, Not):
+            return self.compound(except_, [self.everything(), self.compile(node.operand)])
+        if isinstance(node, Or):
+            return self.compound(union, [self.compile(operand) for operand in node.operands])
+
+        # "a AND NOT b" subtracts b from a instead of intersecting a with
+        # everything but b.
+        positive = [
+            self.compile(operand) for operand in node.operands
+            if not isinstance(operand, Not)
+        ]
+        negative = [
+            self.compile(operand.operand) for operand in node.operands
+            if isinstance(operand, Not)
+        ]
+        ids = self.compound(intersect, positive or [self.everything()])
+        if negative:
+            ids = self.compound(except_, [ids, *negative])
+        return ids
+
+    def compound(self, operation, selects):
+        if len(selects) == 1:
+            return selects[0]
+        # SQLite does not accept nested compound selects without a subquery.
+        ids = operation(*selects).subquery()
+        return select(ids.c[self.item_id.name])
+
+    def tagged(self, label):
+        # Served by the (user_id, normalized_label) and (tag_id, item) indexes.
+        return self.items(self.tag_table.c.normalized_label == self.normalize(label))
+
+    def everything(self):
+        return self.items()
+
+    def items(self, *criteria):
+        tag_ids = select(self.tag_table.c.id) \
+            .where(self.tag_table.c.user_id == self.user_id, *criteria)
+        return select(self.item_id).where(self.association.c.tag_id.in_(tag_ids))
+
+
+def compile_query(node, association, item_id, tag_table, user_id, normalize):
+    # Selects the IDs of the user's items matching the parsed query.
+    return _Compiler(
+        association, item_id, tag_table, user_id, normalize).compile(node)